@@ -0,0 +1,97 @@
+# encoding: utf-8
+'''
+Reference (pure Python) implementations of the hot paths, as they were
+before being vectorized. Used by the benchmarks as correctness oracle and
+as baseline.
+'''
+from math import floor
+import random
+
+import numpy as np
+
+
+def non_aligned_count_base(x, k, base=10, lam=1):
+    r = 0
+    window = 0
+    mx = 0
+    cnt = [0] * (base ** k)
+    lookup_limit = floor(lam * (base ** k)) + (k - 1)
+    for l in range(lookup_limit):
+        while r - l < k:
+            window = base * window + (ord(x[r]) - ord('0'))
+            r += 1
+
+        window = window % base ** k
+
+        cnt[window] += 1
+        mx = max(mx, cnt[window])
+    return cnt, mx
+
+
+def aligned_count(x, k, base=10, lambda_value=1):
+    window = 0
+    mx = 0
+    cnt = [0] * (base ** k)
+    lookup_limit = k * floor(lambda_value * (base ** k)) + (k - 1)
+    for l in range(0, lookup_limit, k):
+        window = int(x[l:l + k], base)
+        cnt[window] += 1
+        mx = max(mx, cnt[window])
+    return cnt, mx
+
+
+def get_words_occurrences(x, lam, k, inc=1):
+    results = {}
+    index = 0
+    while index < len(x) - k:
+        word = x[index: index + k]
+        if word in results:
+            results[word] += 1
+        else:
+            results[word] = 1
+        index += inc
+    return results
+
+
+def log_morse(pos):
+    power = 1
+    ans = False
+    while power <= pos:
+        if pos & power > 0:
+            ans = not ans
+        power *= 2
+    return '1' if ans else '0'
+
+
+def log_rudin(pos):
+    power = 3
+    ans = False
+    while power <= pos:
+        if pos & power == power:
+            ans = not ans
+        power *= 2
+    return '0' if ans else '1'
+
+
+def thue_morse_sequence(length, start=0):
+    return ''.join([log_morse(i**2) for i in range(start, start + length)])
+
+
+def rudin_sequence(length, start=0):
+    return ''.join([log_rudin(i**2) for i in range(start, start + length)])
+
+
+def fibonacci_sequence(length, base=10):
+    have = 0
+    chunks = []
+    a, b = 0, 1
+    while have < length:
+        add = np.base_repr(a, base)
+        chunks.append(add)
+        have += len(add)
+        a, b = b, a+b
+    return ''.join(chunks)[:length]
+
+
+def random_sequence(length, base):
+    return random.choices(range(base), k=length)
@@ -0,0 +1,256 @@
+# encoding: utf-8
+'''
+Benchmarks of the counting and generation hot paths.
+
+Every case runs in a fresh process and reports its best time over a few
+repeats, throughput (digits per second), peak RSS, the peak memory traced
+by tracemalloc and the blocks a run allocates (still alive at its end, its
+result included), and whether its result matches the
+reference implementations (benchmarks.reference) when the case is small
+enough to run them.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --quick --compare results.json
+'''
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from benchmarks import reference
+
+
+def _random_sequence(base, length, packed=False):
+    from poisson.sequence import Sequence
+    rng = np.random.default_rng(0)
+    return Sequence(base, f'Random b{base}', sequence=rng.integers(0, base, length, dtype=np.uint8), packed=packed)
+
+
+def _count_case(params, aligned):
+    from poisson.analysis.counting import non_aligned_lookup_limit, aligned_lookup_limit
+    from poisson.analysis.poisson import non_aligned_count, aligned_count
+
+    base, k, lam = params['base'], params['k'], params['lam']
+    if aligned:
+        digits = k * aligned_lookup_limit(k, base, lam)
+        count_function, reference_function = aligned_count, reference.aligned_count
+    else:
+        digits = non_aligned_lookup_limit(k, base, lam) + k - 1
+        count_function, reference_function = non_aligned_count, reference.non_aligned_count_base
+    a_sequence = _random_sequence(base, digits, params.get('packed', False))
+
+    def run():
+        return count_function(a_sequence, k, lam, use_cache=False)
+
+    def run_reference():
+        return reference_function(a_sequence.sequence, k, base, lam)
+
+    def check(result, expected):
+        return list(result[0]) == expected[0] and result[1] == expected[1]
+
+    return digits, run, run_reference, check
+
+
+def _words_case(params):
+    from poisson.analysis.poisson import get_words_occurrences
+
+    # get_non_aligned_words_occurrences only reads 2 ** k digits whatever the
+    # base, the words of base ** k digits are counted with get_words_occurrences
+    base, k, lam = params['base'], params['k'], params['lam']
+    digits = int(lam * base ** k) + k - 1
+    x = _random_sequence(base, digits).sequence
+
+    def run():
+        return get_words_occurrences(x, lam, k)
+
+    def run_reference():
+        return reference.get_words_occurrences(x, lam, k)
+
+    return digits, run, run_reference, lambda result, expected: result == expected
+
+
+def _generator_case(params, name):
+    from poisson import sequence
+
+    length = params['length']
+    base = params.get('base')
+    start = params.get('start', 0)
+    run, run_reference = {
+        'thue_morse': (lambda: sequence.thue_morse_digits(length, start),
+                       lambda: reference.thue_morse_sequence(length, start)),
+        'rudin': (lambda: sequence.rudin_digits(length, start),
+                  lambda: reference.rudin_sequence(length, start)),
+        'fibonacci': (lambda: sequence.fibonacci_digits(length, base),
+                      lambda: reference.fibonacci_sequence(length, base)),
+        'random': (lambda: sequence.RandomSequence(base, length).digits, None),
+    }[name]
+
+    def check(result, expected):
+        return sequence.digits_to_string(result) == expected
+
+    return length, run, run_reference, check
+
+
+def _make_case(name, params):
+    if name in ('non_aligned_count', 'aligned_count'):
+        return _count_case(params, aligned=name == 'aligned_count')
+    if name == 'words_occurrences':
+        return _words_case(params)
+    return _generator_case(params, name)
+
+
+def cases(quick=False):
+    '''
+    Returns the benchmark grid as a list of (name, params)
+    '''
+    lams = [1] if quick else [1, 3]
+    count_ks = {2: [8, 12] if quick else [8, 12, 16, 20], 10: [2, 4] if quick else [2, 4, 6]}
+    aligned_ks = {2: [8, 12] if quick else [8, 12, 16], 10: [2, 4] if quick else [2, 4, 5]}
+    words_ks = {2: [8] if quick else [8, 16], 10: [4] if quick else [4, 6]}
+    lengths = [10 ** 5] if quick else [10 ** 5, 10 ** 6, 10 ** 7]
+
+    grid = []
+    for base in (2, 10):
+        for lam in lams:
+            grid += [('non_aligned_count', {'base': base, 'k': k, 'lam': lam}) for k in count_ks[base]]
+            grid += [('aligned_count', {'base': base, 'k': k, 'lam': lam}) for k in aligned_ks[base]]
+            if base == 2:
+                grid += [('non_aligned_count', {'base': base, 'k': k, 'lam': lam, 'packed': True})
+                         for k in count_ks[base]]
+        grid += [('words_occurrences', {'base': base, 'k': k, 'lam': 1}) for k in words_ks[base]]
+    for length in lengths:
+        grid += [('thue_morse', {'length': length}), ('rudin', {'length': length})]
+        grid += [('fibonacci', {'length': length, 'base': base}) for base in (2, 10)]
+        grid += [('random', {'length': length, 'base': base}) for base in (2, 10)]
+    # squares past 2 ** 64 (the 128-bit path): across 2 ** 32 and 2 ** 40, and
+    # with low halves close to 2 ** 32 (carries between the 64-bit words)
+    for start in (2 ** 32 - 5 * 10 ** 4, 2 ** 32 + 0xFFFF0000, 2 ** 40 - 5 * 10 ** 4, 2 ** 40 + 0xFFFF0000):
+        grid += [('thue_morse', {'length': 10 ** 5, 'start': start}), ('rudin', {'length': 10 ** 5, 'start': start})]
+    return grid
+
+
+def _max_rss():
+    # kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def measure(name, params, repeat=3, oracle_limit=3 * 10 ** 6, time_reference=False):
+    '''
+    Runs a single case and returns its measures as a dict
+    '''
+    digits, run, run_reference, check = _make_case(name, params)
+    setup_rss = _max_rss()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = run()
+        times.append(time.perf_counter() - start)
+    peak_rss = _max_rss()
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    traced_result = run()
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    # blocks allocated by the run, compared while its result is still referenced
+    allocated_blocks = sum(max(stat.count_diff, 0) for stat in
+                           tracemalloc.take_snapshot().compare_to(before, 'lineno'))
+    tracemalloc.stop()
+    del traced_result
+
+    measures = {
+        'case': name,
+        'params': params,
+        'digits': digits,
+        'seconds': min(times),
+        'digits_per_second': digits / min(times) if min(times) > 0 else None,
+        'setup_rss_bytes': setup_rss,
+        'peak_rss_bytes': peak_rss,
+        'traced_peak_bytes': traced_peak,
+        'allocated_blocks': allocated_blocks,
+        'correct': None,
+    }
+    if run_reference is not None and digits <= oracle_limit:
+        start = time.perf_counter()
+        expected = run_reference()
+        reference_seconds = time.perf_counter() - start
+        measures['correct'] = bool(check(result, expected))
+        if time_reference:
+            measures['reference_seconds'] = reference_seconds
+            measures['speedup'] = reference_seconds / min(times) if min(times) > 0 else None
+    return measures
+
+
+def _case_key(measures):
+    return measures['case'] + ' ' + ' '.join(f'{key}={value}' for key, value in sorted(measures['params'].items()))
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--quick', action='store_true', help='run a reduced grid')
+    parser.add_argument('--case', action='append', help='only run these cases (can be repeated)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--oracle-limit', type=int, default=3 * 10 ** 6,
+                        help='largest case (in digits) checked against the reference implementation')
+    parser.add_argument('--reference', action='store_true', help='also report the reference time and speedup')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare throughput with')
+    args = parser.parse_args(argv)
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as afile:
+            previous = {_case_key(measures): measures for measures in json.load(afile)['results']}
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name, params in cases(args.quick):
+        if args.case and name not in args.case:
+            continue
+        # a new process per case, so that peak RSS belongs to that case alone
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            measures = executor.submit(measure, name, params, args.repeat, args.oracle_limit, args.reference).result()
+        results.append(measures)
+
+        line = f'{_case_key(measures):55} {measures["seconds"]:10.4f}s {measures["digits_per_second"] or 0:14.0f} digits/s'
+        line += f' {measures["peak_rss_bytes"] / 2 ** 20:8.1f} MiB'
+        if measures['correct'] is not None:
+            line += ' ok' if measures['correct'] else ' MISMATCH'
+        if 'speedup' in measures:
+            line += f' x{measures["speedup"]:.1f} vs reference'
+        if _case_key(measures) in previous and previous[_case_key(measures)]['digits_per_second']:
+            line += f' ({measures["digits_per_second"] / previous[_case_key(measures)]["digits_per_second"]:.2f} vs previous)'
+        print(line, flush=True)
+
+    if args.output:
+        with open(args.output, 'w') as afile:
+            json.dump({'metadata': _metadata(), 'results': results}, afile, indent=2)
+    return 0 if all(measures['correct'] is not False for measures in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
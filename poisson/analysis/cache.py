@@ -0,0 +1,216 @@
+# encoding: utf-8
+'''
+On-disk cache of analysis results.
+
+Results are stored as compressed .npz files named after a hash of the
+function name and its arguments (and CACHE_VERSION), where a Sequence
+argument is replaced by a key of the digits the call reads: file backed
+sequences by their file (path, size and modification time, without reading
+it), other sequences by a hash of the scanned prefix. The cache is bounded
+in size: when it grows past `max_bytes` the least recently used files are
+removed.
+
+Calls scanning fewer than CACHE_MIN_DIGITS digits, or fewer digits than the
+bytes of their result (count tables of base ** k words), are cheaper to
+recompute than to load and are not cached.
+
+It is enabled by default and configured with set_cache or the environment
+variables POISSON_CACHE (0 disables it), POISSON_CACHE_DIR and
+POISSON_CACHE_MAX_BYTES. Every cached function also accepts `use_cache=False`.
+'''
+import contextvars
+import functools
+import hashlib
+import inspect
+import os
+import tempfile
+
+import numpy as np
+
+from poisson.sequence import Sequence
+
+
+_config = {
+    'enabled': os.environ.get('POISSON_CACHE', '1') != '0',
+    'directory': os.environ.get('POISSON_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'poisson')),
+    'max_bytes': int(os.environ.get('POISSON_CACHE_MAX_BYTES', 2 ** 30)),
+}
+
+# arguments that do not change results, left out of the cache keys
+NON_KEY_ARGUMENTS = ('threads',)
+
+# part of every key, changed when results or keys change format
+CACHE_VERSION = 2
+
+# smaller calls are not cached (see the module docstring)
+CACHE_MIN_DIGITS = 2 ** 20
+CACHE_MIN_DIGITS_PER_BYTE = 1
+
+# use_cache value of the outermost cached call, inherited by nested calls
+_use_cache = contextvars.ContextVar('use_cache', default=None)
+
+
+def set_cache(enabled=None, directory=None, max_bytes=None):
+    '''
+    Changes the cache configuration (None values are left as they are)
+
+    :param enabled: turn the cache on or off
+    :param directory: where the .npz files are stored
+    :param max_bytes: size bound of the directory
+    '''
+    if enabled is not None:
+        _config['enabled'] = enabled
+    if directory is not None:
+        _config['directory'] = directory
+    if max_bytes is not None:
+        _config['max_bytes'] = max_bytes
+
+
+def clear_cache():
+    for path, size, mtime in _cache_files():
+        os.remove(path)
+
+
+def sequence_hash(a_sequence, stop=None, block_size=2 ** 24):
+    '''
+    Returns a key of the base and the first stop digits of a_sequence (all of
+    them by default). File backed sequences are keyed by their file, other
+    sequences by a hash of those digits (computed once per object and stop).
+    '''
+    stop = a_sequence.length if stop is None else min(stop, a_sequence.length)
+    if a_sequence.file_backed and a_sequence.file:
+        stat = os.stat(a_sequence.file)
+        return f'file:{os.path.realpath(a_sequence.file)}:{stat.st_size}:{stat.st_mtime_ns}:{a_sequence.base}'
+    if getattr(a_sequence, '_content_hashes', None) is None:
+        a_sequence._content_hashes = {}
+    if stop not in a_sequence._content_hashes:
+        digest = hashlib.sha1(f'{a_sequence.base}:{stop}:'.encode('ascii'))
+        for start in range(0, stop, block_size):
+            digest.update(np.ascontiguousarray(a_sequence.get_digits(start, min(start + block_size, stop))).tobytes())
+        a_sequence._content_hashes[stop] = digest.hexdigest()
+    return a_sequence._content_hashes[stop]
+
+
+def _argument_key(value, stop=None):
+    if isinstance(value, Sequence):
+        return f'Sequence({sequence_hash(value, stop)})'
+    if callable(value):
+        return f'{value.__module__}.{value.__qualname__}'
+    return repr(value)
+
+
+def _encode(result):
+    if isinstance(result, tuple):
+        return 'tuple', [np.asarray(item) for item in result]
+    return 'list', [np.asarray(result)]
+
+
+def _decode(kind, arrays):
+    if kind == 'tuple':
+        return tuple(array.item() if array.ndim == 0 else array for array in arrays)
+    return arrays[0].tolist()
+
+
+def _cache_files():
+    directory = _config['directory']
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.npz'):
+            stat = entry.stat()
+            files.append((entry.path, stat.st_size, stat.st_mtime))
+    return files
+
+
+def _evict():
+    files = sorted(_cache_files(), key=lambda item: item[2])
+    total = sum(size for path, size, mtime in files)
+    for path, size, mtime in files:
+        if total <= _config['max_bytes']:
+            break
+        os.remove(path)
+        total -= size
+
+
+def _load(path):
+    with np.load(path) as data:
+        arrays = [data[f'item{i}'] for i in range(len(data.files) - 1)]
+        kind = str(data['kind'])
+    os.utime(path)
+    return _decode(kind, arrays)
+
+
+def _store(path, result):
+    kind, arrays = _encode(result)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as afile:
+            np.savez_compressed(afile, kind=kind, **{f'item{i}': array for i, array in enumerate(arrays)})
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _evict()
+
+
+def cached(func=None, digits=None, result_bytes=None):
+    '''
+    Decorator storing func results in the on-disk cache.
+    The decorated function accepts an extra `use_cache` keyword argument,
+    which also applies to the cached functions it calls.
+
+    :param digits: digits(arguments) returns how many leading digits of the
+        Sequence argument the result depends on (None: all of them), given
+        the bound arguments as a dict
+    :param result_bytes: result_bytes(arguments) returns the size of the
+        result, when it is known before the call
+    '''
+    if func is None:
+        return functools.partial(cached, digits=digits, result_bytes=result_bytes)
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, use_cache=None, **kwargs):
+        if use_cache is None:
+            use_cache = _use_cache.get()
+        if use_cache is None:
+            use_cache = _config['enabled']
+        token = _use_cache.set(use_cache)
+        try:
+            return _call(func, signature, digits, result_bytes, use_cache, args, kwargs)
+        finally:
+            _use_cache.reset(token)
+
+    return wrapper
+
+
+def _call(func, signature, digits, result_bytes, use_cache, args, kwargs):
+    if not use_cache:
+        return func(*args, **kwargs)
+
+    arguments = signature.bind(*args, **kwargs)
+    arguments.apply_defaults()
+    arguments = arguments.arguments
+    stop = digits(arguments) if digits else None
+    if stop is not None and (stop < CACHE_MIN_DIGITS or
+                             result_bytes and result_bytes(arguments) * CACHE_MIN_DIGITS_PER_BYTE > stop):
+        return func(*args, **kwargs)
+    key = ';'.join(f'{name}={_argument_key(value, stop)}' for name, value in arguments.items()
+                   if name not in NON_KEY_ARGUMENTS)
+    key = f'v{CACHE_VERSION}:{func.__module__}.{func.__qualname__}({key})'
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    path = os.path.join(_config['directory'], f'{func.__name__}-{digest}.npz')
+
+    if os.path.exists(path):
+        try:
+            return _load(path)
+        except (OSError, ValueError, KeyError):
+            pass
+    result = func(*args, **kwargs)
+    try:
+        _store(path, result)
+    except OSError:
+        pass
+    return result
@@ -0,0 +1,620 @@
+# encoding: utf-8
+'''
+NumPy counting engines.
+
+Sequences are handled as uint8 digit arrays (digit values, not characters)
+and every k-word is coded as an integer in base `base`, most significant
+digit first (the same order ``int(word, base)`` uses).
+'''
+from concurrent.futures import ThreadPoolExecutor
+from math import floor
+import os
+import threading
+import warnings
+
+import numpy as np
+
+from poisson.instrument import stage
+from poisson.sequence import digits_from_string, digits_to_string
+
+
+def to_digits(x):
+    '''
+    Returns x as a uint8 digit array.
+
+    :param x: a sequence as string (digits as characters) or as an array of digits
+    '''
+    if isinstance(x, str):
+        return digits_from_string(x)
+    return np.asarray(x, dtype=np.uint8)
+
+
+# overlapping words coded per doubling chunk: its int64 temporaries stay in cache
+DOUBLING_CHUNK = 2 ** 14
+# shortest word coded by doubling, shorter ones take one pass per digit
+DOUBLING_MIN_K = 4
+
+
+def word_codes(digits, k, base, n, inc=1):
+    '''
+    Returns the codes of the n words of length k starting at 0, inc, 2 * inc, ...
+    Overlapping words (inc=1) are coded by doubling (see doubling_codes),
+    the others with one multiply-add pass per digit.
+
+    :param digits: a uint8 digit array
+    :param k: word length
+    :param base: the sequence base
+    :param n: number of words
+    :param inc: step between word starts
+    '''
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    last = (n - 1) * inc
+    if last + k > len(digits):
+        raise IndexError(f'sequence too short: {last + k} digits needed, {len(digits)} available')
+    with stage('word codes', nbytes=last + k):
+        if inc == 1 and k >= DOUBLING_MIN_K:
+            codes = np.empty(n, dtype=np.int64)
+            for start in range(0, n, DOUBLING_CHUNK):
+                m = min(DOUBLING_CHUNK, n - start)
+                codes[start:start + m] = doubling_codes(digits[start:start + m + k - 1], k, base, m)
+            return codes
+        codes = digits[0:last + 1:inc].astype(np.int64)
+        for t in range(1, k):
+            np.multiply(codes, base, out=codes)
+            np.add(codes, digits[t:last + t + 1:inc], out=codes)
+    return codes
+
+
+def doubling_codes(digits, k, base, n):
+    '''
+    Returns the codes of the n overlapping words of length k of digits in
+    about 2 * log2(k) passes: the codes of the words of length 2p are
+    code_p[i] * base ** p + code_p[i + p], and the code of length k joins
+    the power of two lengths of its binary expansion.
+    '''
+    size = n + k - 1
+    part = digits[:size].astype(np.int64)
+    p = 1
+    codes = None
+    length = 0
+    remaining = k
+    while True:
+        if remaining & 1:
+            if codes is None:
+                codes = part
+            else:
+                codes = codes[:size - length - p + 1] * base ** p
+                codes += part[length:size - p + 1]
+            length += p
+        remaining >>= 1
+        if not remaining:
+            break
+        doubled = part[:size - 2 * p + 1] * base ** p
+        doubled += part[p:size - p + 1]
+        part = doubled
+        p *= 2
+    return codes[:n]
+
+
+def decode_words(codes, k, base):
+    '''
+    Returns the words (strings of length k) of the given codes.
+    '''
+    codes = np.asarray(codes, dtype=np.int64)
+    place_values = base ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    text = digits_to_string((codes[:, None] // place_values % base).astype(np.uint8).ravel())
+    return [text[i:i + k] for i in range(0, len(text), k)]
+
+
+def encode_words(words, base):
+    '''
+    Returns the codes of the given words (strings of the same length).
+    '''
+    if not words:
+        return np.zeros(0, dtype=np.int64)
+    k = len(words[0])
+    digits = digits_from_string(''.join(words)).reshape(len(words), k)
+    codes = digits[:, 0].astype(np.int64)
+    for t in range(1, k):
+        codes = codes * base + digits[:, t]
+    return codes
+
+
+def non_aligned_codes(digits, k, base, n):
+    '''
+    Returns the codes of the first n overlapping words of length k.
+    Word i is digits[i:i + k].
+
+    :param digits: a uint8 digit array
+    :param k: word length
+    :param base: the sequence base
+    :param n: number of words
+    '''
+    return word_codes(digits, k, base, n)
+
+
+# longest word extracted from packed bits: k + 7 bits must fit in an uint64
+PACKED_MAX_K = 57
+
+
+def packed_word_codes(bits, k, n, inc=1):
+    '''
+    Returns the codes of the n base 2 words of length k starting at bit
+    0, inc, 2 * inc, ... of bits, digits packed 8 per byte (see
+    poisson.sequence.pack_digits). The bytes are loaded as big endian uint64
+    words, one per byte offset, and every code is a shift and a mask of the
+    word holding its first bit.
+
+    :param bits: a uint8 array of packed digits
+    :param k: word length (up to PACKED_MAX_K)
+    :param n: number of words
+    :param inc: step between word starts
+    '''
+    if k > PACKED_MAX_K:
+        raise ValueError(f'words of length {k} can not be extracted from packed bits (max {PACKED_MAX_K})')
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    last = (n - 1) * inc
+    if last + k > len(bits) * 8:
+        raise IndexError(f'sequence too short: {last + k} digits needed, {len(bits) * 8} available')
+    with stage('packed word codes', nbytes=(last + k + 7) // 8):
+        m = last // 8 + 1
+        padded = np.zeros(m + 7, dtype=np.uint8)
+        available = bits[:m + 7]
+        padded[:len(available)] = available
+        words = np.zeros(m, dtype=np.uint64)
+        for t in range(8):
+            np.left_shift(words, np.uint64(8), out=words)
+            np.bitwise_or(words, padded[t:t + m], out=words)
+        mask = np.uint64((1 << k) - 1)
+        if inc == 1:
+            codes = np.empty(n, dtype=np.uint64)
+            for offset in range(min(8, n)):
+                shifted = words[:len(range(offset, n, 8))] >> np.uint64(64 - k - offset)
+                codes[offset::8] = shifted & mask
+        else:
+            starts = np.arange(n, dtype=np.uint64) * np.uint64(inc)
+            codes = (words[starts >> np.uint64(3)] >> (np.uint64(64 - k) - (starts & np.uint64(7)))) & mask
+    return codes.view(np.int64)
+
+
+def count_codes(codes, k, base):
+    '''
+    Returns (cnt, mx): the number of occurrences of every word code
+    and the maximum of those values.
+    '''
+    with stage('count codes'):
+        cnt = np.bincount(codes, minlength=base ** k)
+        mx = int(cnt.max()) if len(cnt) else 0
+    return cnt, mx
+
+
+# largest dense count table (in bytes) allocated by the histogram functions,
+# larger tables are replaced by sort based counting
+DENSE_TABLE_BYTES = 2 ** 30
+
+
+def check_code_range(k, base):
+    if base ** k > 2 ** 63:
+        raise ValueError(f'words of length {k} in base {base} do not fit in int64 codes')
+
+
+def count_histogram_codes(codes, k, base, budget=None):
+    '''
+    Returns (cnt_j, mx): cnt_j[j] is the number of words of length k
+    appearing exactly j times in codes and mx the maximum j.
+    Codes are counted in a dense table when it fits in budget bytes
+    (DENSE_TABLE_BYTES by default), otherwise they are sorted and
+    run-length counted.
+    '''
+    check_code_range(k, base)
+    if budget is None:
+        budget = DENSE_TABLE_BYTES
+    if (base ** k) * 8 <= budget:
+        cnt, mx = count_codes(codes, k, base)
+        return np.bincount(cnt, minlength=mx + 1), mx
+    if len(codes) == 0:
+        return np.array([base ** k], dtype=np.int64), 0
+    with stage('sort count codes'):
+        codes = np.sort(codes)
+        starts = np.flatnonzero(np.diff(codes)) + 1
+        run_lengths = np.diff(np.concatenate(([0], starts, [len(codes)])))
+        cnt_j = np.bincount(run_lengths)
+    cnt_j[0] = base ** k - len(run_lengths)
+    return cnt_j, len(cnt_j) - 1
+
+
+def histogram_snapshots(codes, limits, k, base, budget=None):
+    '''
+    Returns the count_histogram_codes (cnt_j, mx) of codes[:limit] for every limit in limits
+    '''
+    check_code_range(k, base)
+    if budget is None:
+        budget = DENSE_TABLE_BYTES
+    if (base ** k) * 8 <= budget:
+        return [(np.bincount(cnt, minlength=mx + 1), mx) for cnt, mx in count_codes_snapshots(codes, limits, k, base)]
+    return [count_histogram_codes(codes[:limit], k, base, budget) for limit in limits]
+
+
+def non_aligned_lookup_limit(k, base, lam):
+    '''
+    Number of overlapping windows scanned for (k, lam).
+    '''
+    return floor(lam * (base ** k)) + (k - 1)
+
+
+def non_aligned_count_digits(digits, k, base=10, lam=1):
+    '''
+    Vectorized version of poisson.analysis.poisson.non_aligned_count_base
+    over a digit array. Returns the same (cnt, mx), with cnt as an array.
+
+    :param digits: a uint8 digit array
+    :param k:
+    :param base: a sequence base
+    :param lam: lambda value
+    '''
+    codes = non_aligned_codes(digits, k, base, non_aligned_lookup_limit(k, base, lam))
+    return count_codes(codes, k, base)
+
+
+# aligned words reduced per np.dot call (bounds the int64 temporary of the dot)
+ALIGNED_CHUNK = 2 ** 16
+
+
+def aligned_codes(digits, k, base, n):
+    '''
+    Returns the codes of the first n aligned words of length k.
+    Word i is digits[i * k:(i + 1) * k]: the digits are viewed (without
+    copy) as an (n, k) array and reduced with a dot product against the
+    place values base ** (k - 1), ..., base, 1.
+
+    :param digits: a uint8 digit array
+    :param k: word length
+    :param base: the sequence base
+    :param n: number of words
+    '''
+    if n * k > len(digits):
+        raise IndexError(f'sequence too short: {n * k} digits needed, {len(digits)} available')
+    blocks = digits[:n * k].reshape(n, k)
+    place_values = base ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    codes = np.empty(n, dtype=np.int64)
+    with stage('aligned codes', nbytes=n * k):
+        for start in range(0, n, ALIGNED_CHUNK):
+            np.dot(blocks[start:start + ALIGNED_CHUNK], place_values, out=codes[start:start + ALIGNED_CHUNK])
+    return codes
+
+
+class TruncatedSequenceWarning(UserWarning):
+    '''
+    A sequence holds fewer aligned words than lambda asks for: only its
+    complete words are counted. Turn it into an error with
+    warnings.simplefilter('error', TruncatedSequenceWarning).
+    '''
+
+
+def warn_truncated(name, k, lam, needed, available):
+    '''
+    Issues a TruncatedSequenceWarning for an aligned count of (k, lam)
+    '''
+    warnings.warn(f'{name} is too short for k={k}, lambda={lam}: {needed} digits needed, {available} available',
+                  TruncatedSequenceWarning, stacklevel=3)
+
+
+def available_aligned_words(k, base, lam, length):
+    '''
+    Returns (n, available): the aligned words scanned for (k, lam) and the
+    complete ones a sequence of length digits holds, min(n, length // k)
+    '''
+    n = aligned_lookup_limit(k, base, lam)
+    return n, min(n, length // k)
+
+
+def aligned_count_digits(digits, k, base=10, lam=1):
+    '''
+    Aligned counting over a digit array. Returns (cnt, mx, truncated):
+    when digits hold fewer than aligned_lookup_limit(k, base, lam) complete
+    words only those are counted and truncated is True.
+
+    :param digits: a uint8 digit array
+    :param k:
+    :param base: a sequence base
+    :param lam: lambda value
+    '''
+    n, available = available_aligned_words(k, base, lam, len(digits))
+    cnt, mx = count_codes(aligned_codes(digits, k, base, available), k, base)
+    return cnt, mx, available < n
+
+
+def aligned_lookup_limit(k, base, lam):
+    '''
+    Number of aligned words scanned for (k, lam): the words starting at
+    0, k, 2k, ... below k * floor(lam * base ** k) + (k - 1).
+    '''
+    return len(range(0, k * floor(lam * (base ** k)) + (k - 1), k))
+
+
+def count_codes_snapshots(codes, limits, k, base):
+    '''
+    Returns the (cnt, mx) of codes[:limit] for every limit in limits,
+    counting each code once: the histogram is accumulated in increasing
+    limit order and copied at each limit.
+    '''
+    cnt = np.zeros(base ** k, dtype=np.int64)
+    results = [None] * len(limits)
+    start = 0
+    with stage('count codes'):
+        for i in sorted(range(len(limits)), key=limits.__getitem__):
+            cnt += np.bincount(codes[start:limits[i]], minlength=base ** k)
+            start = limits[i]
+            results[i] = (cnt.copy(), int(cnt.max()))
+    return results
+
+
+def non_aligned_count_grid_digits(digits, ks, lams, base=10, histogram=False):
+    '''
+    Returns results[k_index][lam_index] = (cnt, mx) of non_aligned_count_digits
+    for every k in ks and lam in lams from a single pass: the codes of the
+    largest k and lambda are computed once, the codes of a smaller k are their
+    prefixes, code // base ** (max_k - k), and a smaller lambda only scans a
+    prefix of the windows.
+
+    :param digits: a uint8 digit array
+    :param ks: a list of word lengths
+    :param lams: a list of lambda values
+    :param base: a sequence base
+    :param histogram: if True (cnt_j, mx) of count_histogram_codes is
+        returned instead of (cnt, mx)
+    '''
+    max_k = max(ks)
+    codes = non_aligned_codes(digits, max_k, base, non_aligned_lookup_limit(max_k, base, max(lams)))
+    return non_aligned_count_grid_codes(codes, ks, lams, base, histogram)
+
+
+def non_aligned_count_grid_codes(codes, ks, lams, base=10, histogram=False):
+    '''
+    non_aligned_count_grid_digits from the codes of the words of length
+    max(ks) (the first non_aligned_lookup_limit(max(ks), base, max(lams)) of them)
+    '''
+    max_k = max(ks)
+    max_lam = max(lams)
+    results = []
+    for k in ks:
+        k_codes = codes[:non_aligned_lookup_limit(k, base, max_lam)]
+        if k < max_k:
+            k_codes = k_codes // (base ** (max_k - k))
+        limits = [non_aligned_lookup_limit(k, base, lam) for lam in lams]
+        snapshots = histogram_snapshots if histogram else count_codes_snapshots
+        results.append(snapshots(k_codes, limits, k, base))
+    return results
+
+
+def aligned_count_grid_digits(digits, ks, lams, base=10, histogram=False, return_truncated=False):
+    '''
+    Returns results[k_index][lam_index] = (cnt, mx) of aligned counting for
+    every k in ks and lam in lams, scanning the words of each k once.
+    As aligned_count_digits, when digits are too short for a (k, lam) only
+    the complete words are counted.
+
+    :param digits: a uint8 digit array
+    :param ks: a list of word lengths
+    :param lams: a list of lambda values
+    :param base: a sequence base
+    :param histogram: if True (cnt_j, mx) of count_histogram_codes is
+        returned instead of (cnt, mx)
+    :param return_truncated: if True every result gets a third item telling
+        whether it was truncated
+    '''
+    return aligned_count_grid_codes(lambda k, n: aligned_codes(digits, k, base, n), ks, lams, base, histogram,
+                                    len(digits), return_truncated)
+
+
+def aligned_count_grid_codes(codes_function, ks, lams, base=10, histogram=False, length=None,
+                             return_truncated=False):
+    '''
+    aligned_count_grid_digits where codes_function(k, n) returns the codes
+    of the first n aligned words of length k, of a sequence of length digits
+    (not checked when None)
+    '''
+    max_lam = max(lams)
+    results = []
+    for k in ks:
+        n = aligned_lookup_limit(k, base, max_lam)
+        available = n if length is None else available_aligned_words(k, base, max_lam, length)[1]
+        codes = codes_function(k, available)
+        limits = [aligned_lookup_limit(k, base, lam) for lam in lams]
+        snapshots = histogram_snapshots if histogram else count_codes_snapshots
+        k_results = snapshots(codes, [min(limit, available) for limit in limits], k, base)
+        if return_truncated:
+            k_results = [result + (limit > available,) for result, limit in zip(k_results, limits)]
+        results.append(k_results)
+    return results
+
+
+def non_aligned_count_multi_digits(digits, ks, base=10, lam=1):
+    '''
+    Returns the (cnt, mx) of non_aligned_count_digits for every k in ks
+    from a single pass (see non_aligned_count_grid_digits).
+
+    :param digits: a uint8 digit array
+    :param ks: a list of word lengths
+    :param base: a sequence base
+    :param lam: lambda value
+    '''
+    return [results[0] for results in non_aligned_count_grid_digits(digits, ks, [lam], base)]
+
+
+def stream_count_blocks(blocks, k, base=10, lam=1, return_truncated=False):
+    '''
+    Returns ((cnt, mx) non aligned, (cnt, mx) aligned) for (k, lam) counting
+    the words of a sequence given as blocks, as the in memory functions do:
+    the blocks must hold the non aligned words, and when they are too short
+    for the aligned ones only the complete aligned words are counted (a
+    TruncatedSequenceWarning is issued, see aligned_count_digits).
+    Memory is bounded by the count tables and one block.
+
+    :param blocks: an iterable of (position, digits) where consecutive blocks
+        overlap in k - 1 digits (see Sequence.iter_blocks)
+    :param k:
+    :param base: a sequence base
+    :param lam: lambda value
+    :param return_truncated: if True the aligned result is (cnt, mx, truncated)
+        and no warning is issued
+    '''
+    non_aligned_words = non_aligned_lookup_limit(k, base, lam)
+    aligned_words = aligned_lookup_limit(k, base, lam)
+    non_aligned_cnt = np.zeros(base ** k, dtype=np.int64)
+    aligned_cnt = np.zeros(base ** k, dtype=np.int64)
+    scanned = 0
+    for position, block in blocks:
+        # words starting in this block: all but the ones in the overlap
+        starts = len(block) - (k - 1)
+        n = min(starts, non_aligned_words - position)
+        if n > 0:
+            non_aligned_cnt += np.bincount(word_codes(block, k, base, n), minlength=base ** k)
+        first = -(-position // k) * k
+        n = min(len(range(first, position + starts, k)), aligned_words - first // k)
+        if n > 0:
+            aligned_cnt += np.bincount(word_codes(block[first - position:], k, base, n, k), minlength=base ** k)
+        scanned = max(scanned, position + len(block))
+    needed = non_aligned_words + k - 1
+    if scanned < needed:
+        raise IndexError(f'sequence too short: {needed} digits needed, {scanned} available')
+    # blocks only hold complete aligned words, so at most scanned // k were counted
+    truncated = available_aligned_words(k, base, lam, scanned)[1] < aligned_words
+    non_aligned = (non_aligned_cnt, int(non_aligned_cnt.max()))
+    if return_truncated:
+        return non_aligned, (aligned_cnt, int(aligned_cnt.max()), truncated)
+    if truncated:
+        warn_truncated('sequence', k, lam, aligned_words * k, scanned)
+    return non_aligned, (aligned_cnt, int(aligned_cnt.max()))
+
+
+# count table bytes per batch chunk: rows are counted together while their
+# tables fit, larger tables are counted one row at a time
+BATCH_TABLE_BYTES = 2 ** 27
+
+
+def batch_word_codes(digits, k, base, n, aligned=False):
+    '''
+    Returns a (rows, n) array with the codes of the first n words of every
+    row of a 2-D digit array (overlapping words, or aligned ones)
+    '''
+    if aligned:
+        blocks = digits[:, :n * k].reshape(len(digits), n, k)
+        codes = blocks[:, :, 0].astype(np.int64)
+        for t in range(1, k):
+            np.multiply(codes, base, out=codes)
+            np.add(codes, blocks[:, :, t], out=codes)
+        return codes
+    codes = digits[:, :n].astype(np.int64)
+    for t in range(1, k):
+        np.multiply(codes, base, out=codes)
+        np.add(codes, digits[:, t:t + n], out=codes)
+    return codes
+
+
+def batch_count_histograms(digits, k, base=10, lam=1, aligned=False, budget=None):
+    '''
+    Returns (cnt_j, mx) for every row of a 2-D uint8 digit array (one
+    sequence per row), as count_histogram does for a single sequence:
+    cnt_j is a (rows, max(mx) + 1) array padded with zeros and mx
+    an array with the max j of every row.
+
+    :param digits: a (rows, length) uint8 digit array
+    :param k: word length
+    :param base: the sequences base
+    :param lam: lambda value
+    :param aligned: count aligned words instead of overlapping ones
+    :param budget: count table bytes per chunk of rows (BATCH_TABLE_BYTES by default)
+    '''
+    check_code_range(k, base)
+    digits = np.asarray(digits, dtype=np.uint8)
+    if budget is None:
+        budget = BATCH_TABLE_BYTES
+    rows = len(digits)
+    size = base ** k
+    if aligned:
+        n = aligned_lookup_limit(k, base, lam)
+        needed = n * k
+    else:
+        n = non_aligned_lookup_limit(k, base, lam)
+        needed = n + k - 1
+    if needed > digits.shape[1]:
+        raise IndexError(f'sequence too short: {needed} digits needed, {digits.shape[1]} available')
+
+    histograms = []
+    chunk = budget // (size * 8)
+    if chunk < 1:
+        for row in digits:
+            histograms.append(count_histogram_codes(batch_word_codes(row[None], k, base, n, aligned)[0], k, base))
+    else:
+        for start in range(0, rows, chunk):
+            with stage('batch count codes', nbytes=min(chunk, rows - start) * needed):
+                codes = batch_word_codes(digits[start:start + chunk], k, base, n, aligned)
+                offsets = np.arange(len(codes), dtype=np.int64)[:, None]
+                codes += offsets * size
+                cnt = np.bincount(codes.ravel(), minlength=len(codes) * size).reshape(len(codes), size)
+                width = int(cnt.max()) + 1 if cnt.size else 1
+                cnt_j = np.bincount((cnt + offsets * width).ravel(), minlength=len(cnt) * width)
+            histograms += [(row_cnt_j, len(row_cnt_j) - 1)
+                           for row_cnt_j in (np.trim_zeros(row, 'b') for row in cnt_j.reshape(len(cnt), width))]
+
+    mx = np.array([row_mx for row_cnt_j, row_mx in histograms], dtype=np.int64)
+    cnt_j = np.zeros((rows, int(mx.max()) + 1 if rows else 1), dtype=np.int64)
+    for row, (row_cnt_j, row_mx) in enumerate(histograms):
+        cnt_j[row, :len(row_cnt_j)] = row_cnt_j
+    return cnt_j, mx
+
+
+# default number of threads of the counting functions (1: serial)
+THREADS = int(os.environ.get('POISSON_THREADS', 1))
+
+# words per chunk of the parallel counter (chunks are at least one count table long)
+PARALLEL_CHUNK_WORDS = 2 ** 22
+
+
+def _merge_tables(tables):
+    return np.add(tables[0], tables[1], out=tables[0])
+
+
+def parallel_count_codes(codes_function, n, k, base, threads, chunk_words=None):
+    '''
+    Returns count_codes of the codes of n words, computing and counting
+    chunks of words in a pool of threads (the NumPy kernels release the GIL).
+    Every thread adds the chunks it takes into its own count table, and the
+    tables are merged with a pairwise tree reduction: the result is the same
+    (cnt, mx) as the serial one. Memory is one count table per thread plus
+    the codes of one chunk per thread.
+
+    :param codes_function: codes_function(start, stop) returns the codes of words start..stop - 1
+    :param n: number of words
+    :param k: word length
+    :param base: the sequence base
+    :param threads: number of threads
+    :param chunk_words: words per chunk, a multiple of 8 (chunk starts then
+        fall on byte boundaries of packed sequences)
+    '''
+    size = base ** k
+    if chunk_words is None:
+        chunk_words = max(PARALLEL_CHUNK_WORDS, -(-size // 8) * 8)
+    starts = iter(range(0, n, chunk_words))
+    lock = threading.Lock()
+
+    def count_chunks():
+        table = np.zeros(size, dtype=np.int64)
+        while True:
+            with lock:
+                start = next(starts, None)
+            if start is None:
+                return table
+            codes = codes_function(start, min(start + chunk_words, n))
+            np.add(table, np.bincount(codes, minlength=size), out=table)
+
+    with stage('parallel count codes'), ThreadPoolExecutor(max_workers=threads) as executor:
+        tables = [future.result() for future in [executor.submit(count_chunks) for _ in range(threads)]]
+        while len(tables) > 1:
+            merged = list(executor.map(_merge_tables, zip(tables[0::2], tables[1::2])))
+            tables = merged + tables[len(merged) * 2:]
+    cnt = tables[0]
+    return cnt, int(cnt.max()) if len(cnt) else 0
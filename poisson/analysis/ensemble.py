@@ -0,0 +1,68 @@
+# encoding: utf-8
+'''
+Ensemble statistics: total variation and max j of many random sequences,
+as a baseline to compare a given sequence with.
+
+The ensemble is a 2-D uint8 array (one sequence per row) counted in batch,
+so that 1000 sequences cost about as much as a single long one.
+
+    ensemble = ensemble_statistics(2, range(1, 17), lam=1, count=1000, seed=0)
+    ensemble['total_variation_bands']  # (len(quantiles), len(ks))
+'''
+import numpy as np
+
+from poisson.analysis.counting import batch_count_histograms, non_aligned_lookup_limit, aligned_lookup_limit
+from poisson.analysis.total_variation import total_variation_batch
+from poisson.instrument import instrumented
+from poisson.sequence import random_digits_batch
+
+
+def ensemble_length(ks, base, lam=1, aligned=False):
+    '''
+    Number of digits per sequence needed to count every k in ks
+    '''
+    if aligned:
+        return max(k * aligned_lookup_limit(k, base, lam) for k in ks)
+    return max(non_aligned_lookup_limit(k, base, lam) + k - 1 for k in ks)
+
+
+@instrumented
+def ensemble_statistics(base, ks, lam=1, count=1000, seed=None, aligned=False,
+                        quantiles=(0.05, 0.5, 0.95), digits=None):
+    '''
+    Returns a dict with the total variation and max j of count random
+    sequences for every k in ks, and their mean and quantiles by k:
+
+        k, quantiles: the given ks and quantiles
+        total_variation, max_j: (count, len(ks)) arrays, one row per sequence
+        total_variation_mean, max_j_mean: arrays by k
+        total_variation_bands, max_j_bands: (len(quantiles), len(ks)) arrays
+
+    :param base: the sequences base
+    :param ks: a list of k values
+    :param lam: lambda value
+    :param count: number of random sequences
+    :param seed: an int or a SeedSequence, rows are random_sequences(base, length, count, seed)
+    :param aligned: count aligned words instead of overlapping ones
+    :param quantiles: quantiles of the bands
+    :param digits: a (count, length) uint8 array to use instead of random sequences
+    '''
+    ks = list(ks)
+    if digits is None:
+        digits = random_digits_batch(count, ensemble_length(ks, base, lam, aligned), base, seed)
+    variations = np.empty((len(digits), len(ks)))
+    max_js = np.empty((len(digits), len(ks)), dtype=np.int64)
+    for k_idx, k in enumerate(ks):
+        cnt_j, mx = batch_count_histograms(digits, k, base, lam, aligned)
+        variations[:, k_idx] = total_variation_batch(cnt_j / (base ** k), lam)
+        max_js[:, k_idx] = mx
+    return {
+        'k': np.array(ks),
+        'quantiles': np.array(quantiles),
+        'total_variation': variations,
+        'max_j': max_js,
+        'total_variation_mean': variations.mean(axis=0),
+        'total_variation_bands': np.quantile(variations, quantiles, axis=0),
+        'max_j_mean': max_js.mean(axis=0),
+        'max_j_bands': np.quantile(max_js, quantiles, axis=0),
+    }
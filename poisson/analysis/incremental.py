@@ -0,0 +1,105 @@
+# encoding: utf-8
+'''
+Stateful counting that grows with lambda (or with the sequence).
+
+Raising lambda only adds words at the end of the scanned prefix, so the
+counts for the new lambda are the old counts plus the newly covered words.
+'''
+import numpy as np
+
+from poisson.analysis.counting import word_codes, aligned_codes, non_aligned_lookup_limit, aligned_lookup_limit, \
+    warn_truncated
+from poisson.instrument import instrumented
+
+
+class IncrementalCounter(object):
+    '''
+    Word counts of a sequence for a given k and mode (non aligned or aligned)
+    that remembers its histogram, its max j and its scan position.
+
+    After extend_to(lam), cnt and mx are those of non_aligned_count (or
+    aligned_count) for lam and cnt_j[j] is the amount of words appearing
+    exactly j times. Aligned counts stop at the last complete word of a
+    short sequence, as aligned_count does (truncated is then True).
+    '''
+    def __init__(self, a_sequence, k, aligned=False):
+        '''
+
+        :param a_sequence: a poisson.Sequence object
+        :param k: word length
+        :param aligned: count aligned words (Q set) instead of overlapping ones (R set)
+        '''
+        self.sequence = a_sequence
+        self.k = k
+        self.aligned = aligned
+        self.lam = 0
+        self.words = 0
+        self.mx = 0
+        self.truncated = False
+        self.cnt = np.zeros(a_sequence.base ** k, dtype=np.int64)
+        self.cnt_j = np.array([a_sequence.base ** k], dtype=np.int64)
+
+    def lookup_limit(self, lam):
+        '''
+        Number of words scanned for lam
+        '''
+        if self.aligned:
+            return aligned_lookup_limit(self.k, self.sequence.base, lam)
+        return non_aligned_lookup_limit(self.k, self.sequence.base, lam)
+
+    @instrumented
+    def extend_to(self, lam):
+        '''
+        Scans the words between the current lambda and lam
+        '''
+        words = self.lookup_limit(lam)
+        if words < self.lookup_limit(self.lam):
+            raise ValueError(f'counts can only be extended (lambda {lam} < {self.lam})')
+        k = self.k
+        if self.aligned and words * k > self.sequence.length:
+            warn_truncated(self.sequence.name, k, lam, words * k, self.sequence.length)
+            self.truncated = True
+            words = self.sequence.length // k
+        n = words - self.words
+        if self.aligned:
+            digits = self.sequence.get_digits(self.words * k, words * k)
+            codes = aligned_codes(digits, k, self.sequence.base, n)
+        else:
+            digits = self.sequence.get_digits(self.words, words + k - 1)
+            codes = word_codes(digits, k, self.sequence.base, n)
+        self._add(codes)
+        self.words = words
+        self.lam = lam
+        return self
+
+    def _add(self, codes):
+        if len(codes) == 0:
+            return
+        if len(codes) * 8 > len(self.cnt):
+            delta = np.bincount(codes, minlength=len(self.cnt))
+            changed = np.flatnonzero(delta)
+            delta = delta[changed]
+        else:
+            changed, delta = np.unique(codes, return_counts=True)
+        old = self.cnt[changed]
+        new = old + delta
+        self.cnt[changed] = new
+
+        self.mx = max(self.mx, int(new.max()))
+        if len(self.cnt_j) <= self.mx:
+            self.cnt_j = np.concatenate((self.cnt_j, np.zeros(self.mx + 1 - len(self.cnt_j), dtype=np.int64)))
+        self.cnt_j -= np.bincount(old, minlength=len(self.cnt_j))
+        self.cnt_j += np.bincount(new, minlength=len(self.cnt_j))
+
+    def result(self):
+        '''
+        Returns a copy of (cnt, mx)
+        '''
+        return self.cnt.copy(), self.mx
+
+    @property
+    def frequencies(self):
+        '''
+        Frequency of each j, as get_frequencies
+        '''
+        return (self.cnt_j / (self.sequence.base ** self.k)).tolist()
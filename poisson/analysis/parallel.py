@@ -0,0 +1,106 @@
+# encoding: utf-8
+'''
+Process pool driver for total variation sweeps.
+
+Every (sequence, k, lambda) point is a job. Jobs are scheduled largest k
+first, and workers map the sequence digits from a file instead of receiving
+them pickled: file backed sequences are mapped from their own file, other
+sequences are saved once to a temporary .npy file (in /dev/shm when
+available).
+'''
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from poisson.analysis.poisson import non_aligned_count, aligned_count, count_histogram, histogram_frequencies
+from poisson.analysis.total_variation import total_variation, non_aligned_max_k, aligned_max_k, \
+    variations_dataframe
+from poisson.instrument import instrumented
+from poisson.sequence import Sequence
+
+
+# sequences opened by each worker, by index in the sequence list
+_worker_sequences = []
+
+
+def _init_worker(specs):
+    _worker_sequences[:] = [Sequence(base, name, file=file) for base, name, file in specs]
+
+
+def _variation_job(seq_idx, k, lam, count_function):
+    a_sequence = _worker_sequences[seq_idx]
+    cnt_j, mx = count_histogram(a_sequence, k, lam, count_function)
+    return total_variation(histogram_frequencies(cnt_j, a_sequence.base, k), lam)
+
+
+def _share(sequence_list, directory):
+    specs = []
+    for index, a_sequence in enumerate(sequence_list):
+        if a_sequence.file_backed:
+            specs.append((a_sequence.base, a_sequence.name, a_sequence.file))
+        else:
+            file = os.path.join(directory, f'sequence-{index}.npy')
+            np.save(file, a_sequence.get_digits())
+            specs.append((a_sequence.base, a_sequence.name, file))
+    return specs
+
+
+def _progress_callback(progress, total):
+    if progress is True:
+        from tqdm import tqdm
+        bar = tqdm(total=total)
+        return lambda done, total: bar.update(1), bar.close
+    if callable(progress):
+        return progress, lambda: None
+    return lambda done, total: None, lambda: None
+
+
+@instrumented
+def total_variation_dataframe_parallel(sequence_list, lambda_value=1, count_function=non_aligned_count,
+                                       max_workers=None, progress=None):
+    '''
+    Parallel version of total_variation_dataframe (and of
+    total_variation_aligned_dataframe when count_function is aligned_count).
+
+    :param sequence_list: a list of Sequence objects
+    :param lambda_value: a lambda value, or a list of them (columns are then
+        indexed by (sequence name, lambda))
+    :param count_function: non_aligned_count or aligned_count
+    :param max_workers: number of worker processes (default: number of CPUs)
+    :param progress: True for a tqdm bar, or a callable(done, total) called after every job
+    '''
+    lambdas = lambda_value if isinstance(lambda_value, list) else [lambda_value]
+    max_k_function = aligned_max_k if count_function is aligned_count else non_aligned_max_k
+
+    jobs = [(seq_idx, k, lam)
+            for seq_idx, a_sequence in enumerate(sequence_list)
+            for lam in lambdas
+            for k in range(1, max_k_function(a_sequence, lam) + 1)]
+    jobs.sort(key=lambda job: -job[1])
+    update, close = _progress_callback(progress, len(jobs))
+
+    variations = {}
+    directory = tempfile.mkdtemp(prefix='poisson-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+    try:
+        specs = _share(sequence_list, directory)
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(specs,)) as executor:
+            futures = {executor.submit(_variation_job, seq_idx, k, lam, count_function): (seq_idx, k, lam)
+                       for seq_idx, k, lam in jobs}
+            for done, future in enumerate(as_completed(futures), 1):
+                variations[futures[future]] = future.result()
+                update(done, len(jobs))
+    finally:
+        close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    columns = []
+    for seq_idx, a_sequence in enumerate(sequence_list):
+        for lam in lambdas:
+            max_k = max_k_function(a_sequence, lam)
+            seq_var = [variations[(seq_idx, k, lam)] for k in range(1, max_k + 1)]
+            name = (a_sequence.name, lam) if isinstance(lambda_value, list) else a_sequence.name
+            columns.append((name, seq_var))
+    return variations_dataframe(columns)
@@ -0,0 +1,405 @@
+# encoding: utf-8
+'''
+Plotting layer (plotly).
+
+The analysis modules only depend on NumPy, so that batch jobs and pool
+workers don't pay for importing plotly and pandas. The plots live here and
+are still reachable from their former modules (poisson.analysis.poisson,
+total_variation and prefix), which import this module on first use.
+
+Figures are built from pre-binned summaries (cnt_j arrays, prefix
+histograms) and every trace is bounded: bar traces hold at most BAR_BUDGET
+bars (consecutive categories are summed beyond it) and line traces at most
+POINT_BUDGET points (evenly sampled beyond it), drawn with WebGL when they
+are longer than WEBGL_POINTS. Figure sizes don't grow with k.
+'''
+from math import ceil
+
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+import numpy as np
+
+from poisson.analysis.counting import encode_words, decode_words
+from poisson.analysis.poisson import non_aligned_count, count_grid, words_counts, \
+    get_non_aligned_words_occurrences
+from poisson.analysis.prefix import aligned_set, prefix_histograms, prefix_histogram, \
+    set_prefix_histogram
+from poisson.analysis.total_variation import get_variation_limit, get_lambda_convergence
+from poisson.instrument import instrumented, stage
+from poisson.sequence import digits_from_string
+
+
+# most bars in a bar trace and points in a line trace
+BAR_BUDGET = 512
+POINT_BUDGET = 5000
+# line traces longer than this are drawn with Scattergl
+WEBGL_POINTS = 1000
+
+
+def _bar(codes, values, labels, budget=None, **kwargs):
+    '''
+    Returns a go.Bar of values by category, where labels(codes) gives the
+    labels of the categories. Above budget (BAR_BUDGET by default) runs of
+    consecutive categories are summed in at most budget bars of the same
+    width, labelled 'first..last'.
+    '''
+    budget = budget or BAR_BUDGET
+    values = np.asarray(values)
+    if len(codes) > budget:
+        with stage('bin bars', nbytes=values.nbytes):
+            starts = np.arange(0, len(codes), ceil(len(codes) / budget))
+            ends = np.append(starts[1:], len(codes)) - 1
+            values = np.add.reduceat(values, starts)
+            x = [f'{first}..{last}' for first, last in zip(labels(codes[starts]), labels(codes[ends]))]
+    else:
+        x = labels(codes)
+    return go.Bar(x=x, y=values, **kwargs)
+
+
+def _prefix_bar(hist, prefix_length, base, keep=None, **kwargs):
+    '''
+    Returns the bars of a prefix histogram, only for the prefixes
+    where keep is nonzero (all of them if keep is None)
+    '''
+    codes = np.arange(len(hist)) if keep is None else np.flatnonzero(keep)
+    return _bar(codes, hist[codes], lambda codes: decode_words(codes, prefix_length, base), **kwargs)
+
+
+def _line(x, y, **kwargs):
+    '''
+    Returns a line trace of at most POINT_BUDGET points (evenly sampled),
+    a go.Scattergl one when it has more than WEBGL_POINTS
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) > POINT_BUDGET:
+        keep = np.unique(np.linspace(0, len(x) - 1, POINT_BUDGET).round().astype(np.int64))
+        x, y = x[keep], y[keep]
+    trace = go.Scattergl if len(x) > WEBGL_POINTS else go.Scatter
+    return trace(x=x, y=y, **kwargs)
+
+
+# Words counts
+
+
+@instrumented
+def plot_j_distribution(sequence_list, ks, lam, wo_function=get_non_aligned_words_occurrences):
+    '''
+    For each sequence and k combination plots
+    the distribution of the J value (number of words repeating
+    exactly j times in the sequence).
+    :param sequence_list:
+    :param ks: a list of k values
+    :param lam: a lambda value
+    '''
+    n_rows = len(sequence_list)
+    n_cols = len(ks)
+
+    subplot_titles = [f'{seq.name}; k: {k}' for seq in sequence_list for k in ks ]
+    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left", subplot_titles=subplot_titles)
+
+    index = 1
+    for sequence in sequence_list:
+        for k in ks:
+            cnt_j = np.bincount(words_counts(sequence, wo_function, lam, k))
+
+            if len(cnt_j) > 0:
+                fila = ceil(index / n_cols)
+                col = ((index - 1) % n_cols) + 1
+                fig.add_trace(_bar(np.arange(len(cnt_j)), cnt_j, lambda js: js.astype(str).tolist(),
+                                   name=f'x: {sequence.name}; k: {k}'),
+                        row=fila, col=col)
+                fig.update_xaxes(type='category')
+            index += 1
+    fig.update_layout(title_text=f'J values distribution (amount of words appearing exactly j times)  lam:{lam}')
+
+    return fig
+
+
+# Total variation
+
+
+@instrumented
+def plot_variation_limit(a_sequence, max_k=8, lam=1, count_function=non_aligned_count):
+    variations = get_variation_limit(a_sequence, max_k, lam, count_function)
+    fig = px.line(x=range(len(variations)),y=variations, log_y=True)
+    fig.update_layout(
+        title=f'Total variation for {a_sequence.name}, lambda: {lam}',
+        xaxis_title="K",
+        yaxis_title="Total variation",
+    )
+
+    fig.show()
+
+
+@instrumented
+def plot_total_variation_comparison(df, title='Sequences and total variation (Poisson) comparison'):
+    fig = go.Figure()
+
+    for col_name in df:
+        fig.add_trace(_line(
+            x=df.index,
+            y=df[col_name],
+            name=col_name,
+        ))
+
+    fig.update_yaxes(type="log")
+    fig.update_layout(
+        title=title,
+        xaxis_title="K",
+        yaxis_title="total variation (log scale)",
+    )
+    fig.show()
+
+
+@instrumented
+def plot_ensemble_comparison(ensemble, df=None, title='Total variation against a random ensemble'):
+    '''
+    Plots the mean and the outer quantile band of an ensemble_statistics
+    result, and the columns of a total variation DataFrame over them
+
+    :param ensemble: an ensemble_statistics result
+    :param df: a total_variation_dataframe result (row i is k = i + 1)
+    '''
+    ks = ensemble['k']
+    low, high = ensemble['total_variation_bands'][0], ensemble['total_variation_bands'][-1]
+    quantiles = ensemble['quantiles']
+    fig = go.Figure()
+    fig.add_trace(_line(ks, high, line={'width': 0}, showlegend=False))
+    fig.add_trace(_line(ks, low, line={'width': 0}, fill='tonexty',
+                        name=f'random q{quantiles[0]:g}-q{quantiles[-1]:g}'))
+    fig.add_trace(_line(ks, ensemble['total_variation_mean'], name='random mean', line={'dash': 'dash'}))
+    if df is not None:
+        for col_name in df:
+            fig.add_trace(_line(df.index + 1, df[col_name], name=col_name))
+
+    fig.update_yaxes(type="log")
+    fig.update_layout(
+        title=title,
+        xaxis_title="K",
+        yaxis_title="total variation (log scale)",
+    )
+    fig.show()
+
+
+@instrumented
+def plot_max_j(sequence, max_k, lambda_set, count_function=non_aligned_count):
+    '''
+    Plots the min J that doesn't have elements for every K between 0 and max_k
+    ie.: plot_max_j(r2_seq, 2, 23, [1/5, 1/3, 1/2, 1, 2, 3, 5], 'Random2')
+    
+    :param sequence: A Sequence object
+    :param base: A sequence base (2, 5, 10, etc)
+    :param max_k:
+    :param lambda_set: a list or single value of lambda
+    :param seq_name: Sequence name
+    '''
+    
+    if not isinstance(lambda_set, list):
+        lambda_set = [lambda_set]
+    
+    ks = list(range(1, max_k))
+    grid = count_grid(sequence, ks, lambda_set, count_function, histogram=True)
+
+    fig = go.Figure()
+    for lam_idx, lam in enumerate(lambda_set):
+        values = [k_results[lam_idx][1] for k_results in grid]
+        fig.add_trace(_line(
+            x=list(range(1, max_k)),
+            y=values,
+            name=f'Lambda: {lam}'
+
+        ))
+    fig.update_layout(
+        title=f'Min J values with no occurrences. Sequence: {sequence.name}',
+        xaxis_title="K",
+        yaxis_title="J",
+    )
+    fig.show()
+
+
+@instrumented
+def plot_max_j_lambda(sequence, ks, lambdas, count_function=non_aligned_count):
+    '''
+    Plots the max J as a function of lambda for every k in ks
+    ie.: plot_max_j_lambda(r2_seq, [8, 12, 16], np.linspace(0.1, 5, 200))
+
+    :param sequence: A Sequence object
+    :param ks: a list of k values
+    :param lambdas: a list of lambda values
+    '''
+    lambdas = sorted(lambdas)
+    fig = go.Figure()
+    for k in ks:
+        max_js, variations = get_lambda_convergence(sequence, k, lambdas, count_function)
+        fig.add_trace(_line(
+            x=lambdas,
+            y=max_js,
+            name=f'K: {k}'
+        ))
+    fig.update_layout(
+        title=f'Max J values by lambda. Sequence: {sequence.name}',
+        xaxis_title="Lambda",
+        yaxis_title="J",
+    )
+    fig.show()
+
+
+# Prefixes
+
+
+@instrumented
+def get_multi_figure(word_occurrences, lam, k, set_name, seq_name, base=None):
+    '''
+    :param word_occurrences: a dict of word occurrences or an array of
+        counts indexed by word code
+    :param base: the words base, inferred from the words of a dict (their
+        largest digit) or from the length of an array (base ** k) by default
+    '''
+    if isinstance(word_occurrences, dict):
+        words = list(word_occurrences)
+        if base is None:
+            base = max(2, int(digits_from_string(''.join(words)).max(initial=0)) + 1)
+        codes = encode_words(words, base)
+        counts = np.bincount(codes, weights=list(word_occurrences.values()), minlength=base ** k).astype(np.int64)
+        present = np.bincount(codes, minlength=base ** k)
+    else:
+        counts = np.asarray(word_occurrences)
+        present = None
+        if base is None:
+            base = round(len(counts) ** (1 / k))
+            if base ** k != len(counts):
+                raise ValueError(f'{len(counts)} counts are not the {k}-words of a base, pass base')
+    hists = prefix_histograms(counts, k, base)
+    present_hists = prefix_histograms(present, k, base) if present is not None else [None] * (k + 1)
+
+    n_rows = 4
+    n_cols = 2
+    n_graphs = n_rows * n_cols
+    
+    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left")
+    index = 1
+    for prefix_length in range(1, 1 + n_graphs):
+        if prefix_length <= k:
+            fila = ceil(index / n_cols)
+            col = ((index - 1) % n_cols) + 1
+            fig.add_trace(_prefix_bar(hists[prefix_length], prefix_length, base, present_hists[prefix_length],
+                                      name=f'len(prefix): {prefix_length}'),
+                      row=fila, col=col)
+            fig.update_xaxes(type='category')
+        index += 1
+    fig.update_layout(title_text=f'Repetitions in {set_name} (lambda: {lam}, k: {k}, x: {seq_name}) by prefix')
+    
+    return fig
+
+
+@instrumented
+def display_prefix_hist(data_dict):
+    prefixes = sorted(data_dict)
+    fig = go.Figure(_bar(np.arange(len(prefixes)), [data_dict[prefix] for prefix in prefixes],
+                         lambda codes: [prefixes[code] for code in codes]))
+    fig.update_layout(title='Prefix distribution')
+    fig.update_xaxes(type='category')
+    fig.show()
+
+
+@instrumented
+def plot_repetitions_lambda_k(sequence, lambdas, ks, prefix_length, set_name, wo_function=get_non_aligned_words_occurrences):
+
+    # prefix_length = 6
+    n_rows = len(lambdas)
+    n_cols = len(ks)
+
+    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left")
+    index = 1
+    base = sequence.base
+    for lam in lambdas:
+        for k in ks:
+            if prefix_length <= k:
+                counts = words_counts(sequence, wo_function, lam, k)
+                fila = ceil(index / n_cols)
+                col = ((index - 1) % n_cols) + 1
+                fig.add_trace(_prefix_bar(prefix_histogram(counts, k, base, prefix_length), prefix_length, base,
+                                          name=f'lambda: {lam}; k: {k}'),
+                        row=fila, col=col)
+                fig.update_xaxes(type='category')
+            index += 1
+    fig.update_layout(title_text=f'Repetitions in {set_name} with prefix length {prefix_length}')
+
+    return fig
+
+
+@instrumented
+def plot_prefix_repetitions_k_j(sequence, ks, lams, js, prefix_length, compute_func=aligned_set):
+    n_rows = len(js)
+    n_cols = len(ks)
+
+    subplot_titles = [f'j: {j}; k: {k}' for j in js for k in ks ]
+    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left", subplot_titles=subplot_titles)
+
+    index = 1
+    for j in js:
+        for k_idx, k in enumerate(ks):
+            # word_occurrences = get_non_aligned_words_occurrences(xs, lam, k)
+            lam = lams[k_idx] if k_idx < len(lams) else lams[0]
+            hist = set_prefix_histogram(compute_func, sequence, lam, k, j, prefix_length) if prefix_length <= k else None
+            if hist is not None and hist.any():
+                fila = ceil(index / n_cols)
+                col = ((index - 1) % n_cols) + 1
+                fig.add_trace(_prefix_bar(hist, prefix_length, sequence.base, hist, name=f'j: {j}; k: {k}; lambda: {lam}'),
+                        row=fila, col=col)
+                fig.update_xaxes(type='category')
+            index += 1
+    fig.update_layout(title_text=f'Repetitions in {compute_func.__name__} for {sequence.name} with prefix length {prefix_length}')
+
+    return fig
+
+
+@instrumented
+def plot_prefix_repetitions_xs_js_lam(sequence_list, js, k, lam, prefix_length, set_function=aligned_set):
+    n_rows = len(sequence_list)
+    n_cols = len(js)
+
+    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left")
+    index = 1
+    for sequence in sequence_list:
+        for j in js:
+            # word_occurrences = get_non_aligned_words_occurrences(xs, lam, k)
+            hist = set_prefix_histogram(set_function, sequence, lam, k, j, prefix_length) if prefix_length <= k else None
+            if hist is not None and hist.any():
+                fila = ceil(index / n_cols)
+                col = ((index - 1) % n_cols) + 1
+                fig.add_trace(_prefix_bar(hist, prefix_length, sequence.base, hist, name=f'x: {sequence.name}; j: {j}'),
+                        row=fila, col=col)
+                fig.update_xaxes(type='category')
+            index += 1
+    fig.update_layout(title_text=f'Repetitions in {set_function.__name__} with prefix length {prefix_length}; lam: {lam}; k: {k}')
+
+    return fig
+
+
+@instrumented
+def plot_prefix_repetitions_xs_js(sequence_list, js, k, prefix_length, set_function=aligned_set):
+    n_rows = len(sequence_list)
+    n_cols = len(js)
+
+    subplot_titles = [f'{sequence.name}; j:{j}' for sequence in sequence_list for j in js ]
+    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left", subplot_titles=subplot_titles)
+    index = 1
+    for sequence in sequence_list:
+        alphabet = ''.join([str(n) for n in range(sequence.base)])
+        for j in js:
+            # word_occurrences = get_non_aligned_words_occurrences(xs, lam, k)
+            lam = 1 / len(alphabet)
+            hist = set_prefix_histogram(set_function, sequence, lam, k, j, prefix_length) if prefix_length <= k else None
+            if hist is not None and hist.any():
+                fila = ceil(index / n_cols)
+                col = ((index - 1) % n_cols) + 1
+                fig.add_trace(_prefix_bar(hist, prefix_length, sequence.base, hist, name=f'x: {sequence.name}; j: {j}; lam: {lam}'),
+                        row=fila, col=col)
+                fig.update_xaxes(type='category')
+            index += 1
+    fig.update_layout(title_text=f'Repetitions in {set_function.__name__} with prefix length {prefix_length}; k: {k}')
+
+    return fig
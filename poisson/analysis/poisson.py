@@ -1,81 +1,299 @@
 # encoding: utf-8
+from collections import Counter
 from itertools import product
-from math import floor, ceil
+from math import floor
 
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
-import pandas as pd
+import numpy as np
 
-def non_aligned_count(a_sequence, k, lambda_value=1):
+from poisson.analysis import counting
+from poisson.analysis.cache import cached
+from poisson.analysis.counting import non_aligned_count_digits, non_aligned_lookup_limit, \
+    non_aligned_count_grid_codes, aligned_count_grid_codes, aligned_lookup_limit, count_codes, \
+    non_aligned_codes, aligned_codes, packed_word_codes, PACKED_MAX_K, to_digits, word_codes, \
+    decode_words, stream_count_blocks, parallel_count_codes, available_aligned_words, warn_truncated, \
+    check_code_range
+from poisson.instrument import instrumented
+from poisson.sequence import digits_to_string
+
+
+def sequence_word_codes(a_sequence, k, n, aligned=False, start=0):
+    '''
+    Returns the codes of n words of length k of a_sequence, overlapping or
+    aligned, from word number start on. Packed sequences are read from their
+    bits (see packed_word_codes), without unpacking the digits.
+    '''
+    base = a_sequence.base
+    first = start * k if aligned else start
+    needed = first + (n * k if aligned else n + k - 1)
+    if a_sequence.packed and k <= PACKED_MAX_K and n > 0 and first % 8 == 0:
+        if needed > a_sequence.length:
+            raise IndexError(f'sequence too short: {needed} digits needed, {a_sequence.length} available')
+        return packed_word_codes(a_sequence.get_bits()[first // 8:], k, n, k if aligned else 1)
+    if aligned:
+        return aligned_codes(a_sequence.get_digits(first, needed), k, base, n)
+    return non_aligned_codes(a_sequence.get_digits(first, needed), k, base, n)
+
+
+def count_sequence_words(a_sequence, k, n, aligned=False, threads=None):
+    '''
+    Returns (cnt, mx) for the first n words of length k of a_sequence.
+    With more than one thread the words are counted by chunks in parallel
+    (see parallel_count_codes), with the same result.
+
+    :param threads: number of threads (counting.THREADS by default)
+    '''
+    base = a_sequence.base
+    threads = threads or counting.THREADS
+    if threads > 1 and n > counting.PARALLEL_CHUNK_WORDS:
+        def codes_function(start, stop):
+            return sequence_word_codes(a_sequence, k, stop - start, aligned, start)
+        return parallel_count_codes(codes_function, n, k, base, threads)
+    return count_codes(sequence_word_codes(a_sequence, k, n, aligned), k, base)
+
+
+def _table_bytes(arguments):
+    # size of a (cnt, mx) result
+    return 8 * arguments['a_sequence'].base ** arguments['k']
+
+
+def _non_aligned_digits(arguments):
+    k = arguments['k']
+    return non_aligned_lookup_limit(k, arguments['a_sequence'].base, arguments['lambda_value']) + k - 1
+
+
+@instrumented
+@cached(digits=_non_aligned_digits, result_bytes=_table_bytes)
+def non_aligned_count(a_sequence, k, lambda_value=1, threads=None):
     '''
     
     :param a_sequence: a poisson.Sequence object
     :param k:
     :param lambda_value:
+    :param threads: count with this many threads (see count_sequence_words)
     '''
-    return non_aligned_count_base(a_sequence.sequence, k, a_sequence.base, lambda_value)
+    return count_sequence_words(a_sequence, k, non_aligned_lookup_limit(k, a_sequence.base, lambda_value),
+                                threads=threads)
 
 
+@instrumented
 def non_aligned_count_base(x, k, base=10, lam=1):
     '''
     Con superposicion (overlapping)
     Non aligned
-    :param x: a sequence
+    :param x: a sequence (string or uint8 digit array)
     :param k:
     :param base: a sequence base
     :param lam: lambda value
     '''
-    r = 0
-    window = 0
-    mx = 0
-    cnt = [0] * (base ** k)
-    lookup_limit = floor(lam * (base ** k)) + (k - 1)
-    for l in range(lookup_limit):
-        while r - l < k:
-            window = base * window + (ord(x[r]) - ord('0'))
-            r += 1
-        
-        window = window % base ** k
-        
-        cnt[window] += 1
-        mx = max(mx, cnt[window])
+    return non_aligned_count_digits(to_digits(x), k, base, lam)
+
+
+@instrumented
+def aligned_count(a_sequence, k, lambda_value=1, return_truncated=False, threads=None, use_cache=None):
+    '''
+    Sin superposicion
+    Aligned: counts the words at 0, k, 2k, ... (see aligned_lookup_limit)
+
+    When the sequence is too short for lambda_value only its complete words
+    are counted and a counting.TruncatedSequenceWarning is issued (also on
+    cached results).
+
+    :param a_sequence: a poisson.Sequence object
+    :param k:
+    :param lambda_value:
+    :param return_truncated: if True (cnt, mx, truncated) is returned instead
+        of warning, where truncated tells whether the sequence was too short
+    :param threads: count with this many threads (see count_sequence_words)
+    :param use_cache: see poisson.analysis.cache
+    '''
+    n, available = available_aligned_words(k, a_sequence.base, lambda_value, a_sequence.length)
+    cnt, mx = _aligned_count(a_sequence, k, available, threads=threads, use_cache=use_cache)
+    truncated = available < n
+    if return_truncated:
+        return cnt, mx, truncated
+    if truncated:
+        warn_truncated(a_sequence.name, k, lambda_value, n * k, a_sequence.length)
     return cnt, mx
 
 
-def aligned_count(a_sequence, k, lambda_value=1):
+@cached(digits=lambda arguments: arguments['n'] * arguments['k'], result_bytes=_table_bytes)
+def _aligned_count(a_sequence, k, n, threads=None):
+    # (cnt, mx) of the first n aligned words
+    return count_sequence_words(a_sequence, k, n, aligned=True, threads=threads)
+
+
+@instrumented
+def non_aligned_count_multi(a_sequence, ks, lambda_value=1):
+    '''
+    Returns [non_aligned_count(a_sequence, k, lambda_value) for k in ks]
+    scanning the sequence once.
+
+    :param a_sequence: a poisson.Sequence object
+    :param ks: a list of k values
+    :param lambda_value:
+    '''
+    return [k_results[0] for k_results in count_grid(a_sequence, ks, [lambda_value])]
+
+
+@instrumented
+def count_grid(a_sequence, ks, lams, count_function=non_aligned_count, histogram=False, return_truncated=False):
+    '''
+    Returns results[k_index][lam_index] = count_function(a_sequence, k, lam)
+    for every k in ks and lam in lams. Non aligned and aligned counts scan
+    the longest prefix once and snapshot the histogram at each lambda.
+    Aligned counts are truncated (and warned about) as aligned_count does.
+
+    :param a_sequence: a poisson.Sequence object
+    :param ks: a list of k values
+    :param lams: a list of lambda values
+    :param count_function: non_aligned_count, aligned_count or any function alike
+    :param histogram: if True the j histogram (cnt_j, mx) is returned instead
+        of (cnt, mx), which lets non aligned and aligned counts switch to sort
+        based counting when base ** k is too large for a dense table
+    :param return_truncated: if True every result gets a third item telling
+        whether it was truncated (only aligned counts are), instead of warning
+    '''
+    if not ks:
+        return []
     base = a_sequence.base
-    x = a_sequence.sequence
-    r = 0
-    window = 0
-    mx = 0
-    cnt = [0] * (base ** k)
-    # lookup_limit = floor(lam*(base**k)) + (k - 1)
-    lookup_limit = k * floor(lambda_value * (base ** k)) + (k - 1)
-    for l in range(0, lookup_limit, k):
-        try:
-            window = int(x[l:l + k], base)
-        except:
-            print('warning! seq length:', len(x), f' ; index: {l}:{l+k}')
-        cnt[window] += 1
-        mx = max(mx, cnt[window])
-    return cnt, mx
+    max_k = max(ks)
+    max_lam = max(lams)
+    if count_function is non_aligned_count:
+        codes = sequence_word_codes(a_sequence, max_k, non_aligned_lookup_limit(max_k, base, max_lam))
+        results = non_aligned_count_grid_codes(codes, ks, lams, base, histogram)
+    elif count_function is aligned_count:
+        def codes_function(k, n):
+            return sequence_word_codes(a_sequence, k, n, aligned=True)
+        results = aligned_count_grid_codes(codes_function, ks, lams, base, histogram, a_sequence.length,
+                                           return_truncated=True)
+        if return_truncated:
+            return results
+        for k, k_results in zip(ks, results):
+            for lam, (counts, mx, truncated) in zip(lams, k_results):
+                if truncated:
+                    warn_truncated(a_sequence.name, k, lam, k * aligned_lookup_limit(k, base, lam), a_sequence.length)
+        return [[(counts, mx) for counts, mx, truncated in k_results] for k_results in results]
+    else:
+        results = [[count_function(a_sequence, k, lam) for lam in lams] for k in ks]
+        if histogram:
+            results = [[(np.bincount(cnt, minlength=mx + 1), mx) for cnt, mx in k_results] for k_results in results]
+    if return_truncated:
+        results = [[result + (False,) for result in k_results] for k_results in results]
+    return results
 
 
-def get_frequencies(a_sequence, k=8, lam=1, count_function=non_aligned_count):
+def count_multi(a_sequence, ks, lam=1, count_function=non_aligned_count, histogram=False):
     '''
-    
+    Returns [count_function(a_sequence, k, lam) for k in ks], sharing
+    a single scan when count_function is non_aligned_count (see count_grid).
+    '''
+    return [k_results[0] for k_results in count_grid(a_sequence, ks, [lam], count_function, histogram)]
+
+
+@instrumented
+def count_histogram(a_sequence, k, lambda_value=1, count_function=non_aligned_count):
+    '''
+    Returns (cnt_j, mx): cnt_j[j] is the amount of words of length k appearing
+    exactly j times according to count_function. Unlike count_function itself,
+    it works for k where a table of base ** k counts does not fit in memory.
+    '''
+    return count_multi(a_sequence, [k], lambda_value, count_function, histogram=True)[0]
+
+
+@instrumented
+def count_lambdas(a_sequence, k, lams, count_function=non_aligned_count):
+    '''
+    Returns [(cnt, mx, freq)] for every lambda in lams, where (cnt, mx) is
+    count_function(a_sequence, k, lam) and freq its j frequencies.
+    The longest prefix is scanned once (see count_grid).
+
+    :param a_sequence: a poisson.Sequence object
+    :param k:
+    :param lams: a list of lambda values
+    :param count_function: non_aligned_count or aligned_count
+    '''
+    return [(cnt, mx, count_frequencies(cnt, mx, a_sequence.base, k))
+            for cnt, mx in count_grid(a_sequence, [k], lams, count_function)[0]]
+
+
+@instrumented
+def stream_count(a_sequence, k, lambda_value=1, block_size=2 ** 24, return_truncated=False):
+    '''
+    Returns (non_aligned_count(a_sequence, k, lambda_value),
+    aligned_count(a_sequence, k, lambda_value)) reading the sequence in blocks
+    of block_size digits, for sequences larger than memory. As aligned_count,
+    the aligned words are truncated (and warned about) when the sequence is
+    too short for them.
+
+    :param a_sequence: a poisson.Sequence object (usually file backed)
+    :param k:
+    :param lambda_value:
+    :param block_size: digits read at a time
+    :param return_truncated: if True the aligned result is (cnt, mx, truncated)
+    '''
+    base = a_sequence.base
+    # iter_blocks stops at the end of shorter sequences
+    stop = max(non_aligned_lookup_limit(k, base, lambda_value) + (k - 1),
+               k * aligned_lookup_limit(k, base, lambda_value))
+    blocks = a_sequence.iter_blocks(block_size, overlap=k - 1, stop=stop)
+    non_aligned, (cnt, mx, truncated) = stream_count_blocks(blocks, k, base, lambda_value, return_truncated=True)
+    if return_truncated:
+        return non_aligned, (cnt, mx, truncated)
+    if truncated:
+        n = aligned_lookup_limit(k, base, lambda_value)
+        warn_truncated(a_sequence.name, k, lambda_value, n * k, a_sequence.length)
+    return non_aligned, (cnt, mx)
+
+
+def count_frequencies(cnt, mx, base, k):
+    '''
+    Returns the frequency of each j (amount of words appearing exactly j times)
+    from a (cnt, mx) count result.
+    '''
+    return histogram_frequencies(np.bincount(cnt, minlength=mx + 1), base, k)
+
+
+def histogram_frequencies(cnt_j, base, k):
+    '''
+    Returns the frequency of each j from a j histogram (cnt_j)
+    '''
+    return (np.asarray(cnt_j) / (base ** k)).tolist()
+
+
+def _frequencies_digits(arguments):
+    a_sequence, k, lam = arguments['a_sequence'], arguments['k'], arguments['lam']
+    if arguments['count_function'] is non_aligned_count:
+        return non_aligned_lookup_limit(k, a_sequence.base, lam) + k - 1
+    if arguments['count_function'] is aligned_count:
+        return k * aligned_lookup_limit(k, a_sequence.base, lam)
+    return None
+
+
+@instrumented
+def get_frequencies(a_sequence, k=8, lam=1, count_function=non_aligned_count, use_cache=None):
+    '''
+    As aligned_count, a TruncatedSequenceWarning is issued (also on cached
+    results) when the sequence is too short for the aligned words.
+
     :param a_sequence:
     :param k:
     :param lam:
     :param count_function:
+    :param use_cache: see poisson.analysis.cache
     '''
+    if count_function is aligned_count:
+        n, available = available_aligned_words(k, a_sequence.base, lam, a_sequence.length)
+        if available < n:
+            warn_truncated(a_sequence.name, k, lam, n * k, a_sequence.length)
+    return _frequencies(a_sequence, k, lam, count_function, use_cache=use_cache)
+
 
-    cnt, mx = count_function(a_sequence, k, lam)
-    cnt_j = [0] * (mx + 1)
-    for j in cnt:
-        cnt_j[j] += 1
-    freq = [val / (a_sequence.base ** k) for val in cnt_j]
-    return freq
+@cached(digits=_frequencies_digits)
+def _frequencies(a_sequence, k, lam, count_function):
+    # j frequencies, truncation is warned about by get_frequencies
+    cnt_j, mx, truncated = count_grid(a_sequence, [k], [lam], count_function, histogram=True,
+                                      return_truncated=True)[0][0]
+    return histogram_frequencies(cnt_j, a_sequence.base, k)
 
 
 # generate words of length k from alphabet
@@ -100,29 +318,82 @@ def filter_dict(dictObj, callback):
     return newDict
 
 
+def get_words_codes(x, k, base=2, inc=1):
+    '''
+    Returns the codes of the words of length k that k_words_generator
+    yields: starting at 0, inc, 2 * inc, ... below len(x) - k
+    :param x: a sequence (string or uint8 digit array)
+    '''
+    check_code_range(k, base)
+    digits = to_digits(x)
+    n = (len(digits) - k - 1) // inc + 1 if len(digits) > k else 0
+    return word_codes(digits, k, base, n, inc)
+
+
+def get_words_counts(x, k, base=2, inc=1):
+    '''
+    Returns the number of occurrences of each word of length k in x
+    as an array indexed by word code (see get_words_codes)
+    '''
+    return np.bincount(get_words_codes(x, k, base, inc), minlength=base ** k)
+
+
+def non_aligned_words_lookup_limit(lam, k):
+    return floor(lam * (2 ** k)) + (k - 1)
+
+
+def aligned_words_lookup_limit(lam, k):
+    return k * floor(lam * (2 ** k))
+
+
+@instrumented
+def get_non_aligned_words_counts(x, lam, k, base=2):
+    '''
+    Returns word counts by code according to R set criteria
+    '''
+    lookup_limit = non_aligned_words_lookup_limit(lam, k)
+    if lookup_limit > len(x):
+        print(f'WARNING: sequence x is too short (<{lookup_limit})')
+
+    return get_words_counts(x[:lookup_limit], k, base, 1)
+
+
+@instrumented
+def get_aligned_words_counts(x, lam, k, base=2):
+    '''
+    Returns word counts by code according to Q set criteria
+    '''
+    lookup_limit = aligned_words_lookup_limit(lam, k)
+    if lookup_limit > len(x):
+        print(f'WARNING: sequence x is too short (<{lookup_limit})')
+
+    return get_words_counts(x[:lookup_limit], k, base, k)
+
+
+@instrumented
 def get_words_occurrences(x, lam, k, inc=1):
     '''
     Returns the number of occurrences for each word of length k
     that's present on x
     @parameter inc: step to find the next word (default: 1)
     '''
-    results = {}
-    gen = k_words_generator(x, k, increment=inc)
-    
-    for word in gen:
-        if word in results:
-            results[word] += 1
-        else:
-            results[word] = 1
-    
-    return results
+    digits = to_digits(x)
+    base = max(2, int(digits.max()) + 1) if len(digits) else 2
+    try:
+        check_code_range(k, base)
+    except ValueError:
+        # the words don't fit in int64 codes, count them as strings
+        x = x if isinstance(x, str) else digits_to_string(digits)
+        return dict(Counter(k_words_generator(x, k, increment=inc)))
+    codes, counts = np.unique(get_words_codes(digits, k, base, inc), return_counts=True)
+    return dict(zip(decode_words(codes, k, base), counts.tolist()))
 
 
 def get_non_aligned_words_occurrences(x, lam, k):
     '''
     Returns word occurrences according to R set criteria
     '''
-    lookup_limit = floor(lam * (2 ** k)) + (k - 1)
+    lookup_limit = non_aligned_words_lookup_limit(lam, k)
     if lookup_limit > len(x):
         print(f'WARNING: sequence x is too short (<{lookup_limit})')
     
@@ -133,13 +404,22 @@ def get_aligned_words_occurrences(x, lam, k):
     '''
     Returns word occurrences according to Q set criteria
     '''
-    lookup_limit = k * floor(lam * (2 ** k))
+    lookup_limit = aligned_words_lookup_limit(lam, k)
     if lookup_limit > len(x):
         print(f'WARNING: sequence x is too short (<{lookup_limit})')
     
     return get_words_occurrences(x[:lookup_limit], lam, k, k)
 
 
+# code based equivalents of the word occurrences functions, and the lookup
+# limit of the digits they read
+WORDS_COUNTS_FUNCTIONS = {
+    get_non_aligned_words_occurrences: (get_non_aligned_words_counts, non_aligned_words_lookup_limit),
+    get_aligned_words_occurrences: (get_aligned_words_counts, aligned_words_lookup_limit),
+}
+
+
+@instrumented
 def fill_occurrences(word_occurrences, alphabet, word_length):
     '''
     Returns the dictionary word_occurrences filled with non appearing
@@ -150,36 +430,27 @@ def fill_occurrences(word_occurrences, alphabet, word_length):
     return all_words_dict
   
 
-def plot_j_distribution(sequence_list, ks, lam, wo_function=get_non_aligned_words_occurrences):
+@instrumented
+def words_counts(sequence, wo_function, lam, k):
     '''
-    For each sequence and k combination plots
-    the distribution of the J value (number of words repeating
-    exactly j times in the sequence).
-    :param sequence_list:
-    :param ks: a list of k values
-    :param lam: a lambda value
+    Returns the counts of all the words of length k by code,
+    as fill_occurrences(wo_function(sequence.sequence, lam, k), ...)
+    :param sequence: a Sequence object
+    :param wo_function: a word occurrences function
     '''
-    n_rows = len(sequence_list)
-    n_cols = len(ks)
-
-    subplot_titles = [f'{seq.name}; k: {k}' for seq in sequence_list for k in ks ]
-    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left", subplot_titles=subplot_titles)
+    if wo_function in WORDS_COUNTS_FUNCTIONS:
+        counts_function, lookup_limit = WORDS_COUNTS_FUNCTIONS[wo_function]
+        return counts_function(sequence.get_digits(0, lookup_limit(lam, k)), lam, k, sequence.base)
+    alphabet = ''.join([str(n) for n in range(sequence.base)])
+    return np.array(list(fill_occurrences(wo_function(sequence.sequence, lam, k), alphabet, k).values()))
 
-    index = 1
-    for sequence in sequence_list:
-        alphabet = ''.join([str(n) for n in range(sequence.base)])
-        for k in ks:
-            wo = fill_occurrences(wo_function(sequence.sequence, lam, k), alphabet, k)  # muy lento
 
-            if len(wo) > 0:
-                df = pd.DataFrame.from_dict(wo, orient='index').sort_index()
-                fila = ceil(index / n_cols)
-                col = ((index - 1) % n_cols) + 1
-                fig.add_trace(go.Histogram(x=df[0], name=f'x: {sequence.name}; k: {k}'),
-                        row=fila, col=col)
-                fig.update_xaxes(type='category')
-            index += 1
-    fig.update_layout(title_text=f'J values distribution (amount of words appearing exactly j times)  lam:{lam}')
+# plots moved to poisson.analysis.plots, imported on first use
+_PLOTS = ('plot_j_distribution',)
 
-    return fig
 
+def __getattr__(name):
+    if name in _PLOTS:
+        from poisson.analysis import plots
+        return getattr(plots, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
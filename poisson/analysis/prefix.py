@@ -1,27 +1,125 @@
 # encoding: utf-8
-from math import ceil
+from collections import OrderedDict
 
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import pandas as pd
+import numpy as np
 
+from poisson.analysis.cache import cached, sequence_hash
+from poisson.analysis.counting import decode_words, encode_words
 from poisson.analysis.poisson import fill_occurrences, \
-    get_non_aligned_words_occurrences, get_aligned_words_occurrences
+    get_non_aligned_words_occurrences, get_aligned_words_occurrences, \
+    get_non_aligned_words_counts, get_aligned_words_counts, \
+    non_aligned_words_lookup_limit, aligned_words_lookup_limit
+from poisson.instrument import instrumented
 
 
+class JSetIndex(object):
+    '''
+    Word codes of length k grouped by number of occurrences: the codes
+    sorted by count (argsort) and the offset where each j starts, so that
+    the words appearing exactly j times, and their prefix histograms, are
+    obtained in O(result) for any j.
+    '''
+    def __init__(self, counts, k, base):
+        '''
+
+        :param counts: number of occurrences of every word, indexed by word code
+        :param k: word length
+        :param base: the sequence base
+        '''
+        counts = np.asarray(counts)
+        self.k = k
+        self.base = base
+        self.order = np.argsort(counts, kind='stable')
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(counts))))
+
+    @property
+    def mx(self):
+        return len(self.offsets) - 2
+
+    @property
+    def nbytes(self):
+        return self.order.nbytes + self.offsets.nbytes
+
+    def codes(self, j):
+        '''
+        Returns the (increasing) codes of the words appearing exactly j times
+        '''
+        if j < 0 or j > self.mx:
+            return self.order[:0]
+        return self.order[self.offsets[j]:self.offsets[j + 1]]
+
+    def count(self, j):
+        '''
+        Returns the number of words appearing exactly j times
+        '''
+        return len(self.codes(j))
+
+    def words(self, j):
+        '''
+        Returns the words (strings) appearing exactly j times
+        '''
+        return decode_words(self.codes(j), self.k, self.base)
+
+    def prefix_histogram(self, j, prefix_length):
+        '''
+        Returns prefix_histogram_from_list(self.words(j), k, base, prefix_length)
+        '''
+        prefixes = self.codes(j) // self.base ** (self.k - prefix_length)
+        return np.bincount(prefixes, minlength=self.base ** prefix_length)
+
+
+# j-set indexes by (sequence key, lambda, k, aligned), most recently used last,
+# bounded by the total bytes of their arrays
+_jset_indexes = OrderedDict()
+JSET_INDEX_BYTES = 2 ** 28
+
+
+def clear_jset_indexes():
+    '''
+    Drops the j-set indexes kept in memory
+    '''
+    _jset_indexes.clear()
+
+
+@instrumented
+def j_set_index(sequence, lam, k, aligned=False):
+    '''
+    Returns the JSetIndex of the words of length k of sequence, counted as
+    aligned_set (aligned=True) or non_aligned_set do. The most recently used
+    indexes are kept in memory (up to JSET_INDEX_BYTES), so calls for
+    several js count once.
+    '''
+    lookup_limit = aligned_words_lookup_limit(lam, k) if aligned else non_aligned_words_lookup_limit(lam, k)
+    key = (sequence_hash(sequence, lookup_limit), lam, k, aligned)
+    index = _jset_indexes.get(key)
+    if index is None:
+        x = sequence.get_digits(0, lookup_limit)
+        if aligned:
+            counts = get_aligned_words_counts(x, lam, k, sequence.base)
+        else:
+            counts = get_non_aligned_words_counts(x, lam, k, sequence.base)
+        index = JSetIndex(counts, k, sequence.base)
+        _jset_indexes[key] = index
+    _jset_indexes.move_to_end(key)
+    total = sum(kept.nbytes for kept in _jset_indexes.values())
+    while _jset_indexes and total > JSET_INDEX_BYTES:
+        total -= _jset_indexes.popitem(last=False)[1].nbytes
+    return index
+
+
+@instrumented
+@cached(digits=lambda arguments: non_aligned_words_lookup_limit(arguments['lam'], arguments['k']))
 def non_aligned_set(sequence, lam, k, j):
     '''
     Returns a list of words of length k that appear exactly j times
     inside x[:floor(lam*(2**k))]
     
     '''
-    x = sequence.sequence
-    alphabet = ''.join([str(n) for n in range(sequence.base)])
-
-    return [word for (word, count) in fill_occurrences(get_non_aligned_words_occurrences(x, lam, k), alphabet, k).items() if count == j]
+    return j_set_index(sequence, lam, k).words(j)
 
 
+@instrumented
+@cached(digits=lambda arguments: aligned_words_lookup_limit(arguments['lam'], arguments['k']))
 def aligned_set(sequence, lam, k, j):
     '''
     Returns a list of words of length k that appear exactly j times
@@ -33,9 +131,17 @@ def aligned_set(sequence, lam, k, j):
     :param k:
     :param j:
     '''
-    x = sequence.sequence
-    alphabet = ''.join([str(n) for n in range(sequence.base)])
-    return [word for (word, count) in fill_occurrences(get_aligned_words_occurrences(x, lam, k), alphabet, k).items() if count == j]
+    return j_set_index(sequence, lam, k, aligned=True).words(j)
+
+
+def set_prefix_histogram(set_function, sequence, lam, k, j, prefix_length):
+    '''
+    Returns the prefix histogram of set_function(sequence, lam, k, j),
+    from the j-set index when set_function is aligned_set or non_aligned_set
+    '''
+    if set_function in (aligned_set, non_aligned_set):
+        return j_set_index(sequence, lam, k, set_function is aligned_set).prefix_histogram(j, prefix_length)
+    return prefix_histogram_from_list(set_function(sequence, lam, k, j), k, sequence.base, prefix_length)
 
 
 def prefix_distribution(occurrence_dict, prefix_length):
@@ -62,139 +168,52 @@ def prefix_distribution_from_list(words_list, prefix_length):
     return prefix_occurrences
 
 
-def get_multi_figure(word_occurrences, lam, k, set_name, seq_name):
+@instrumented
+def prefix_histograms(counts, k, base):
+    '''
+    Returns the prefix distributions of a counts array (indexed by word code)
+    for every prefix length: hists[p][code] is the sum of the counts of the
+    words whose prefix of length p has that code, for p in 0..k.
+    Computed in one hierarchical pass, each level summing base consecutive
+    entries of the next one.
+    '''
+    hists = [np.asarray(counts)]
+    for p in range(k, 0, -1):
+        hists.append(hists[-1].reshape(base ** (p - 1), base).sum(axis=1))
+    return hists[::-1]
+
+
+def prefix_histogram(counts, k, base, prefix_length):
+    '''
+    Returns the prefix distribution of a counts array for a single prefix length
+    '''
+    return np.asarray(counts).reshape(base ** prefix_length, base ** (k - prefix_length)).sum(axis=1)
+
+
+def prefix_histogram_from_list(words_list, k, base, prefix_length):
+    '''
+    Returns prefix_distribution_from_list of a list of words of length k
+    as an array indexed by prefix code
+    '''
+    counts = np.bincount(encode_words(words_list, base), minlength=base ** k)
+    return prefix_histogram(counts, k, base, prefix_length)
+
+
+# plots moved to poisson.analysis.plots, imported on first use
+_PLOTS = ('get_multi_figure', 'display_prefix_hist', 'plot_repetitions_lambda_k', 'plot_prefix_repetitions_k_j',
+          'plot_prefix_repetitions_xs_js_lam', 'plot_prefix_repetitions_xs_js')
+
+# fill_occurrences and the word occurrences functions are re-exported for
+# code importing them from this module, as it used to
+__all__ = ['JSetIndex', 'JSET_INDEX_BYTES', 'clear_jset_indexes', 'j_set_index', 'non_aligned_set', 'aligned_set',
+           'set_prefix_histogram', 'prefix_distribution', 'prefix_distribution_from_list', 'prefix_histograms',
+           'prefix_histogram', 'prefix_histogram_from_list', 'fill_occurrences',
+           'get_non_aligned_words_occurrences', 'get_aligned_words_occurrences']
+__all__ += _PLOTS
 
-    prefix_length = 6
-    n_rows = 4
-    n_cols = 2
-    n_graphs = n_rows * n_cols
-    
-    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left")
-    index = 1
-    for prefix_length in range(1, 1 + n_graphs):
-        prefix_dict = prefix_distribution(word_occurrences, prefix_length)
-        df = pd.DataFrame.from_dict(prefix_dict, orient='index').sort_index()
-        if len(prefix_dict) > 0:
-            fila = ceil(index / n_cols)
-            col = ((index - 1) % n_cols) + 1
-            fig.add_trace(go.Bar(x=df.index, y=df[0], name=f'len(prefix): {prefix_length}'),
-                      row=fila, col=col)
-            fig.update_xaxes(type='category')
-        index += 1
-    fig.update_layout(title_text=f'Repetitions in {set_name} (lambda: {lam}, k: {k}, x: {seq_name}) by prefix')
-    
-    return fig
-
-
-def display_prefix_hist(data_dict):
-    df = pd.DataFrame.from_dict(data_dict, orient='index').sort_index()
-    fig = px.bar(df, x=df.index, y=df[0], title='Prefix distribution')
-    fig.update_xaxes(type='category')
-    fig.show()
-
-
-def plot_repetitions_lambda_k(sequence, lambdas, ks, prefix_length, set_name, wo_function=get_non_aligned_words_occurrences):
-
-    # prefix_length = 6
-    n_rows = len(lambdas)
-    n_cols = len(ks)
-
-    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left")
-    index = 1
-    alphabet = ''.join([str(n) for n in range(sequence.base)])
-    for lam in lambdas:
-        for k in ks:
-            word_occurrences = fill_occurrences(wo_function(sequence.sequence, lam, k), alphabet, k)
-
-            prefix_dict = prefix_distribution(word_occurrences, prefix_length)
-            df = pd.DataFrame.from_dict(prefix_dict, orient='index').sort_index()
-            fila = ceil(index / n_cols)
-            col = ((index - 1) % n_cols) + 1
-            fig.add_trace(go.Bar(x=df.index, y=df[0], name=f'lambda: {lam}; k: {k}'),
-                    row=fila, col=col)
-            fig.update_xaxes(type='category')
-            index += 1
-    fig.update_layout(title_text=f'Repetitions in {set_name} with prefix length {prefix_length}')
-
-    return fig
-
-
-def plot_prefix_repetitions_k_j(sequence, ks, lams, js, prefix_length, compute_func=aligned_set):
-    n_rows = len(js)
-    n_cols = len(ks)
-
-    subplot_titles = [f'j: {j}; k: {k}' for j in js for k in ks ]
-    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left", subplot_titles=subplot_titles)
-
-    index = 1
-    for j in js:
-        for k_idx, k in enumerate(ks):
-            # word_occurrences = get_non_aligned_words_occurrences(xs, lam, k)
-            lam = lams[k_idx] if k_idx < len(lams) else lams[0]
-            wo = compute_func(sequence, lam, k, j)
-            if len(wo) > 0: 
-                prefix_dict = prefix_distribution_from_list(wo, prefix_length)
-                df = pd.DataFrame.from_dict(prefix_dict, orient='index').sort_index()
-                fila = ceil(index / n_cols)
-                col = ((index - 1) % n_cols) + 1
-                fig.add_trace(go.Bar(x=df.index, y=df[0], name=f'j: {j}; k: {k}; lambda: {lam}'),
-                        row=fila, col=col)
-                fig.update_xaxes(type='category')
-            index += 1
-    fig.update_layout(title_text=f'Repetitions in {compute_func.__name__} for {sequence.name} with prefix length {prefix_length}')
-
-    return fig
-
-
-def plot_prefix_repetitions_xs_js_lam(sequence_list, js, k, lam, prefix_length, set_function=aligned_set):
-    n_rows = len(sequence_list)
-    n_cols = len(js)
-
-    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left")
-    index = 1
-    for sequence in sequence_list:
-        for j in js:
-            # word_occurrences = get_non_aligned_words_occurrences(xs, lam, k)
-            wo = set_function(sequence, lam, k, j)
-
-            if len(wo) > 0:
-                prefix_dict = prefix_distribution_from_list(wo, prefix_length)
-                df = pd.DataFrame.from_dict(prefix_dict, orient='index').sort_index()
-                fila = ceil(index / n_cols)
-                col = ((index - 1) % n_cols) + 1
-                fig.add_trace(go.Bar(x=df.index, y=df[0], name=f'x: {sequence.name}; j: {j}'),
-                        row=fila, col=col)
-                fig.update_xaxes(type='category')
-            index += 1
-    fig.update_layout(title_text=f'Repetitions in {set_function.__name__} with prefix length {prefix_length}; lam: {lam}; k: {k}')
-
-    return fig
-
-
-def plot_prefix_repetitions_xs_js(sequence_list, js, k, prefix_length, set_function=aligned_set):
-    n_rows = len(sequence_list)
-    n_cols = len(js)
-
-    subplot_titles = [f'{sequence.name}; j:{j}' for sequence in sequence_list for j in js ]
-    fig = make_subplots(rows=n_rows, cols=n_cols, start_cell="top-left", subplot_titles=subplot_titles)
-    index = 1
-    for sequence in sequence_list:
-        alphabet = ''.join([str(n) for n in range(sequence.base)])
-        for j in js:
-            # word_occurrences = get_non_aligned_words_occurrences(xs, lam, k)
-            lam = 1 / len(alphabet)
-            wo = set_function(sequence, lam, k, j)
-
-            if len(wo) > 0:
-                prefix_dict = prefix_distribution_from_list(wo, prefix_length)
-                df = pd.DataFrame.from_dict(prefix_dict, orient='index').sort_index()
-                fila = ceil(index / n_cols)
-                col = ((index - 1) % n_cols) + 1
-                fig.add_trace(go.Bar(x=df.index, y=df[0], name=f'x: {sequence.name}; j: {j}; lam: {lam}'),
-                        row=fila, col=col)
-                fig.update_xaxes(type='category')
-            index += 1
-    fig.update_layout(title_text=f'Repetitions in {set_function.__name__} with prefix length {prefix_length}; k: {k}')
-
-    return fig
 
+def __getattr__(name):
+    if name in _PLOTS:
+        from poisson.analysis import plots
+        return getattr(plots, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
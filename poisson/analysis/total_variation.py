@@ -1,128 +1,153 @@
 # encoding: utf-8
-import plotly.express as px
-import plotly.graph_objects as go
-
-import pandas as pd
-from scipy.stats import poisson
-from poisson.analysis.poisson import non_aligned_count, aligned_count
+import numpy as np
+from poisson.analysis.poisson import non_aligned_count, aligned_count, count_multi, \
+    histogram_frequencies
 import math
 
+from poisson.analysis.incremental import IncrementalCounter
+from poisson.instrument import instrumented
+
 
 # Total variation
 
+# poisson pmf tables by lambda, grown on demand
+_pmf_tables = {}
+
+
+def poisson_pmf(lam, size):
+    '''
+    Returns [poisson.pmf(j, lam) for j in range(size)] as a (read only) array
+    '''
+    table = _pmf_tables.get(lam)
+    if table is None or len(table) < size:
+        # scipy is only needed here, imported on first use
+        from scipy.stats import poisson
+        table = poisson.pmf(np.arange(max(size, 64)), lam)
+        table.flags.writeable = False
+        _pmf_tables[lam] = table
+    return table[:size]
+
+
 def total_variation(freq, lam=1):
-    remaining = 1
-    distance = 0
-    for j in range(len(freq)):
-        p = poisson.pmf(j,lam)
-        distance += abs(freq[j] - p)
-        remaining -= p
-    distance += remaining
+    freq = np.asarray(freq, dtype=float)
+    p = poisson_pmf(lam, len(freq))
+    # mass of j >= len(freq), where freq is 0
+    remaining = 1 - p.sum()
+    distance = np.abs(freq - p).sum() + remaining
     return distance / 2
 
 
+@instrumented
+def total_variation_batch(freqs, lam=1):
+    '''
+    Returns [total_variation(freq, lam) for freq in freqs] in one array operation.
+    Shorter frequency vectors are padded with zeros, which leaves their
+    distance unchanged (the padded terms move from the tail mass to the sum).
+
+    :param freqs: a 2-D array, or a list of frequency vectors
+    :param lam: a lambda value, or one per frequency vector
+    '''
+    if not isinstance(freqs, np.ndarray):
+        size = max((len(freq) for freq in freqs), default=0)
+        padded = np.zeros((len(freqs), size))
+        for row, freq in enumerate(freqs):
+            padded[row, :len(freq)] = freq
+        freqs = padded
+    freqs = np.asarray(freqs, dtype=float)
+    lams = np.broadcast_to(np.asarray(lam, dtype=float), (len(freqs),))
+    p = np.empty_like(freqs)
+    for value in np.unique(lams):
+        p[lams == value] = poisson_pmf(value, freqs.shape[1])
+    remaining = 1 - p.sum(axis=1)
+    return (np.abs(freqs - p).sum(axis=1) + remaining) / 2
+
+
+@instrumented
 def get_variation_limit(a_sequence, max_k=8, lam=1, count_function=non_aligned_count):
-    variations = []
-    for k in range(1, max_k+1):
-        cnt, mx = count_function(a_sequence, k, lam)
-        cnt_j = [0] * (mx+1)
-        for j in cnt:
-            cnt_j[j] += 1
-        freq = [val /  (a_sequence.base**k) for val in cnt_j]
-        variations.append(total_variation(freq, lam))
-    return variations
+    ks = list(range(1, max_k+1))
+    freqs = [histogram_frequencies(cnt_j, a_sequence.base, k)
+             for k, (cnt_j, mx) in zip(ks, count_multi(a_sequence, ks, lam, count_function, histogram=True))]
+    return total_variation_batch(freqs, lam).tolist()
+
+
+def non_aligned_max_k(a_sequence, lambda_value=1):
+    '''
+    Largest k used by total_variation_dataframe for a_sequence
+    '''
+    return math.floor(math.log(a_sequence.length / lambda_value, a_sequence.base)) - 1
+
 
+def aligned_max_k(a_sequence, lambda_value=1):
+    '''
+    Largest k used by total_variation_aligned_dataframe for a_sequence
+    '''
+    # lookup_limit = k*floor(lambda_value*(base**k)) + (k - 1)
+    scale_aprox = 5 # ~= log_2(30)
+    return math.floor(math.log(a_sequence.length / lambda_value, a_sequence.base)  / scale_aprox)
 
-def plot_variation_limit(a_sequence, max_k=8, lam=1, count_function=non_aligned_count):
-    variations = get_variation_limit(a_sequence, max_k, lam, count_function)
-    fig = px.line(x=range(len(variations)),y=variations, log_y=True)
-    fig.update_layout(
-        title=f'Total variation for {a_sequence.name}, lambda: {lam}',
-        xaxis_title="K",
-        yaxis_title="Total variation",
-    )
 
-    fig.show()
+def variations_dataframe(variations):
+    '''
+    Builds a DataFrame with a column per (name, variation list) pair
+    '''
+    import pandas as pd
+    if not variations:
+        return pd.DataFrame()
+    return pd.concat([pd.Series(seq_var, name=name, dtype=float) for name, seq_var in variations], axis=1)
 
 
+@instrumented
 def total_variation_dataframe(sequence_list, lambda_value=1):
-    df = pd.DataFrame()
-    
+    variations = []
     for a_sequence in sequence_list:
-        max_k = math.floor(math.log(a_sequence.length / lambda_value, a_sequence.base)) - 1
+        max_k = non_aligned_max_k(a_sequence, lambda_value)
         seq_var = get_variation_limit(a_sequence, max_k=max_k, lam=lambda_value, count_function=non_aligned_count)
-        df = pd.concat([df, pd.DataFrame({a_sequence.name: seq_var})], axis=1)
-    return df
+        variations.append((a_sequence.name, seq_var))
+    return variations_dataframe(variations)
 
+@instrumented
 def total_variation_aligned_dataframe(sequence_list, lambda_value=1):
-    df = pd.DataFrame()
-    
+    variations = []
     for a_sequence in sequence_list:
-        # lookup_limit = k*floor(lambda_value*(base**k)) + (k - 1)
-        scale_aprox = 5 # ~= log_2(30)
-        max_k = math.floor(math.log(a_sequence.length / lambda_value, a_sequence.base)  / scale_aprox)
+        max_k = aligned_max_k(a_sequence, lambda_value)
         seq_var = get_variation_limit(a_sequence, max_k=max_k, lam=lambda_value, count_function=aligned_count)
-        df = pd.concat([df, pd.DataFrame({a_sequence.name: seq_var})], axis=1)
-    return df
-
-
-def plot_total_variation_comparison(df, title='Sequences and total variation (Poisson) comparison'):
-    fig = go.Figure()
-
-    for col_name in df:
-        fig.add_trace(go.Scatter(
-            x=df.index,
-            y=df[col_name],
-            name=col_name,
-        ))
-
-    fig.update_yaxes(type="log")
-    fig.update_layout(
-        title=title,
-        xaxis_title="K",
-        yaxis_title="total variation (log scale)",
-    )
-    fig.show()
-    
-    
+        variations.append((a_sequence.name, seq_var))
+    return variations_dataframe(variations)
+
+
+@instrumented
 def get_max_j_values(sequence, max_k, lam, count_function=non_aligned_count):
     '''
     Returns the min J that doesn't have elements for every K between 0 and max_k
     '''
-    values = []
-    for k in range(1, max_k):
-        cnt, mx = count_function(sequence, k, lambda_value=lam)
-        values.append(mx)
-    return values
+    ks = list(range(1, max_k))
+    if not ks:
+        return []
+    return [mx for cnt_j, mx in count_multi(sequence, ks, lam, count_function, histogram=True)]
 
 
-def plot_max_j(sequence, max_k, lambda_set, count_function=non_aligned_count):
+@instrumented
+def get_lambda_convergence(sequence, k, lambdas, count_function=non_aligned_count):
     '''
-    Plots the min J that doesn't have elements for every K between 0 and max_k
-    ie.: plot_max_j(r2_seq, 2, 23, [1/5, 1/3, 1/2, 1, 2, 3, 5], 'Random2')
-    
-    :param sequence: A Sequence object
-    :param base: A sequence base (2, 5, 10, etc)
-    :param max_k:
-    :param lambda_set: a list or single value of lambda
-    :param seq_name: Sequence name
+    Returns (max_js, variations) for each lambda in lambdas (in increasing
+    order), extending a single IncrementalCounter from one lambda to the next.
     '''
-    
-    if not isinstance(lambda_set, list):
-        lambda_set = [lambda_set]
-    
-    fig = go.Figure()
-    for lam in lambda_set:
-        values = get_max_j_values(sequence, max_k, lam, count_function)
-        fig.add_trace(go.Scatter(
-            x=list(range(1, max_k)),
-            y=values,
-            name=f'Lambda: {lam}'
-
-        ))
-    fig.update_layout(
-        title=f'Min J values with no occurrences. Sequence: {sequence.name}',
-        xaxis_title="K",
-        yaxis_title="J",
-    )
-    fig.show()
+    counter = IncrementalCounter(sequence, k, aligned=count_function is aligned_count)
+    max_js = []
+    variations = []
+    for lam in sorted(lambdas):
+        counter.extend_to(lam)
+        max_js.append(counter.mx)
+        variations.append(total_variation(counter.frequencies, lam))
+    return max_js, variations
+
+
+# plots moved to poisson.analysis.plots, imported on first use
+_PLOTS = ('plot_variation_limit', 'plot_total_variation_comparison', 'plot_max_j', 'plot_max_j_lambda')
+
+
+def __getattr__(name):
+    if name in _PLOTS:
+        from poisson.analysis import plots
+        return getattr(plots, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
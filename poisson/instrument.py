@@ -0,0 +1,202 @@
+# encoding: utf-8
+'''
+Opt-in timing instrumentation.
+
+Public analysis functions and the main internal stages (sequence generation,
+word coding, counting, dict filling, figure building) are recorded while a
+recorder is active:
+
+    with profile() as recorder:
+        total_variation_dataframe(sequences)
+    print(recorder.summary_table())
+    recorder.save_chrome_trace('trace.json')  # chrome://tracing, Perfetto
+
+Setting the environment variable POISSON_PROFILE=1 records the whole
+process and prints the summary at exit (POISSON_PROFILE=trace.json also
+saves the trace there). When no recorder is active, instrumented functions
+only pay one global lookup.
+'''
+import atexit
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+
+class _Frame(object):
+    __slots__ = ('name', 'start', 'nbytes', 'children')
+
+    def __init__(self, name, start, nbytes):
+        self.name = name
+        self.start = start
+        self.nbytes = nbytes
+        self.children = 0.0
+
+
+class Recorder(object):
+    '''
+    Collects (stage, start, duration, self time, bytes, thread) events.
+    Bytes processed by a stage are also added to the stages enclosing it,
+    and the self time of a stage excludes the time of its inner stages.
+    '''
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.events = []
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def enter(self, name, nbytes=0):
+        self._stack().append(_Frame(name, time.perf_counter(), nbytes))
+
+    def exit(self):
+        end = time.perf_counter()
+        stack = self._stack()
+        frame = stack.pop()
+        duration = end - frame.start
+        if stack:
+            stack[-1].children += duration
+            stack[-1].nbytes += frame.nbytes
+        self.events.append((frame.name, frame.start - self.origin, duration, duration - frame.children,
+                            frame.nbytes, threading.get_ident()))
+
+    def summary(self):
+        '''
+        Returns a list of dicts (stage, calls, total_s, self_s, bytes, bytes_per_s)
+        sorted by total time
+        '''
+        stages = {}
+        for name, start, duration, self_time, nbytes, thread in self.events:
+            row = stages.setdefault(name, {'stage': name, 'calls': 0, 'total_s': 0.0, 'self_s': 0.0, 'bytes': 0})
+            row['calls'] += 1
+            row['total_s'] += duration
+            row['self_s'] += self_time
+            row['bytes'] += nbytes
+        for row in stages.values():
+            row['bytes_per_s'] = row['bytes'] / row['total_s'] if row['total_s'] > 0 else 0.0
+        return sorted(stages.values(), key=lambda row: -row['total_s'])
+
+    def summary_table(self):
+        '''
+        Returns the summary as a text table
+        '''
+        lines = [f'{"stage":40} {"calls":>8} {"total s":>10} {"self s":>10} {"MB":>10} {"MB/s":>10}']
+        for row in self.summary():
+            lines.append(f'{row["stage"]:40} {row["calls"]:8d} {row["total_s"]:10.4f} {row["self_s"]:10.4f} '
+                         f'{row["bytes"] / 1e6:10.2f} {row["bytes_per_s"] / 1e6:10.2f}')
+        return '\n'.join(lines)
+
+    def summary_dataframe(self):
+        '''
+        Returns the summary as a pandas DataFrame
+        '''
+        import pandas as pd
+        return pd.DataFrame(self.summary())
+
+    def chrome_trace(self):
+        '''
+        Returns the events in Chrome trace-event format
+        '''
+        pid = os.getpid()
+        return {'traceEvents': [
+            {'name': name, 'ph': 'X', 'ts': start * 1e6, 'dur': duration * 1e6, 'pid': pid, 'tid': thread,
+             'args': {'bytes': nbytes, 'self_ms': self_time * 1e3}}
+            for name, start, duration, self_time, nbytes, thread in self.events
+        ]}
+
+    def save_chrome_trace(self, filename):
+        with open(filename, 'w') as afile:
+            json.dump(self.chrome_trace(), afile)
+
+
+_recorder = None
+
+
+def get_recorder():
+    '''
+    Returns the active recorder (None when instrumentation is disabled)
+    '''
+    return _recorder
+
+
+@contextlib.contextmanager
+def profile(recorder=None):
+    '''
+    Records the instrumented stages run inside the context
+
+    :param recorder: a Recorder to add the events to (a new one by default)
+    '''
+    global _recorder
+    previous = _recorder
+    _recorder = recorder if recorder is not None else Recorder()
+    try:
+        yield _recorder
+    finally:
+        _recorder = previous
+
+
+class _Stage(object):
+    __slots__ = ('recorder', 'name', 'nbytes')
+
+    def __init__(self, recorder, name, nbytes):
+        self.recorder = recorder
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.recorder.enter(self.name, self.nbytes)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.exit()
+
+
+_NO_STAGE = contextlib.nullcontext()
+
+
+def stage(name, nbytes=0):
+    '''
+    Context manager recording a stage (if a recorder is active)
+
+    :param name: stage name
+    :param nbytes: bytes processed by the stage
+    '''
+    recorder = _recorder
+    if recorder is None:
+        return _NO_STAGE
+    return _Stage(recorder, name, nbytes)
+
+
+def instrumented(func):
+    '''
+    Decorator recording every call of func as a stage named after it
+    (its qualified name)
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = _recorder
+        if recorder is None:
+            return func(*args, **kwargs)
+        recorder.enter(func.__qualname__)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            recorder.exit()
+
+    return wrapper
+
+
+def _report_at_exit(target):
+    print(_recorder.summary_table())
+    if target.endswith('.json'):
+        _recorder.save_chrome_trace(target)
+
+
+if os.environ.get('POISSON_PROFILE', '0') not in ('', '0'):
+    _recorder = Recorder()
+    atexit.register(_report_at_exit, os.environ['POISSON_PROFILE'])
@@ -0,0 +1,288 @@
+# encoding: utf-8
+'''
+Batch runner for j-frequency / total variation / max j sweeps.
+
+A sweep is a set of sequences, a k range, a list of lambdas and the counting
+modes (non_aligned, aligned). Every (sequence, mode, k, lambda) point is
+saved as soon as it is computed to its own .npz file in the output
+directory, so running the same sweep again only computes the missing points
+(a crashed or interrupted overnight run resumes where it stopped). When all
+points are done they are gathered in a columnar summary (summary.npz, or a
+Parquet file with --summary results.parquet, which needs pandas and pyarrow).
+
+    python -m poisson.run spec.json --output results/
+    python -m poisson.run --sequence thue_morse:1000000 --sequence fibonacci:1000000 \\
+        --bases 2,10 --ks 1:16 --lambdas 0.5,1,2 --modes non_aligned,aligned --output results/
+
+A spec file is a JSON object with the same keys:
+
+    {
+        "sequences": [
+            {"type": "thue_morse", "length": 1000000},
+            {"type": "fibonacci", "length": 1000000, "base": [2, 10]},
+            {"type": "random", "length": 1000000, "seed": 1},
+            {"type": "file", "path": "pi.txt", "base": 10, "name": "Pi"}
+        ],
+        "bases": [2, 10],
+        "ks": [1, 16],
+        "lambdas": [0.5, 1, 2],
+        "modes": ["non_aligned", "aligned"]
+    }
+
+Sequences without a base use every base in "bases" (Thue-Morse and Rudin
+are binary). "ks" is an inclusive [first, last] range; without it every k
+up to the largest one total_variation_dataframe would use is computed.
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+import numpy as np
+
+from poisson.analysis.poisson import non_aligned_count, aligned_count, count_grid, histogram_frequencies
+from poisson.analysis.total_variation import total_variation, non_aligned_max_k, aligned_max_k
+from poisson.sequence import Sequence, ThueMorseSequence, RudinSequence, FibonacciSequence, RandomSequence
+
+
+MODES = {
+    'non_aligned': (non_aligned_count, non_aligned_max_k),
+    'aligned': (aligned_count, aligned_max_k),
+}
+
+BINARY_TYPES = ('thue_morse', 'rudin')
+
+
+def expand_sequences(spec):
+    '''
+    Returns a list of (type, base, options) for the sequences of a spec,
+    one per base
+    '''
+    expanded = []
+    for options in spec['sequences']:
+        kind = options['type']
+        if kind in BINARY_TYPES:
+            bases = [2]
+        else:
+            bases = options.get('base', spec.get('bases', [2]))
+            bases = bases if isinstance(bases, list) else [bases]
+        expanded += [(kind, base, options) for base in bases]
+    return expanded
+
+
+def build_sequence(kind, base, options):
+    '''
+    Returns the Sequence object described by a spec entry
+    '''
+    if kind == 'thue_morse':
+        return ThueMorseSequence(options['length'])
+    if kind == 'rudin':
+        return RudinSequence(options['length'])
+    if kind == 'fibonacci':
+        return FibonacciSequence(base, options['length'])
+    if kind == 'random':
+        return RandomSequence(base, options['length'], seed=options.get('seed', 0),
+                              name=sequence_name(kind, base, options))
+    if kind == 'file':
+        return Sequence(base, sequence_name(kind, base, options), file=options['path'])
+    raise ValueError(f'unknown sequence type {kind!r}')
+
+
+def sequence_name(kind, base, options):
+    '''
+    Returns the name of build_sequence(kind, base, options) without building it
+    '''
+    names = {
+        'thue_morse': lambda: 'Thue-Morse',
+        'rudin': lambda: 'Rudin',
+        'fibonacci': lambda: f'Fibonacci b{base}',
+        'random': lambda: f'Random b{base} s{options.get("seed", 0)}',
+        'file': lambda: options.get('name', os.path.splitext(os.path.basename(options['path']))[0]),
+    }
+    return names[kind]()
+
+
+def _slug(name):
+    return re.sub(r'[^A-Za-z0-9.-]+', '_', name).strip('_')
+
+
+def point_name(kind, base, options):
+    '''
+    Returns the name of the point files of a spec entry: its sequence name,
+    followed by the length of generated sequences, or by a hash of the file
+    path for file sequences (files with the same name may live in different
+    directories)
+    '''
+    name = sequence_name(kind, base, options)
+    if kind == 'file':
+        path = os.path.realpath(options['path'])
+        name += '_' + hashlib.sha1(path.encode('utf-8')).hexdigest()[:10]
+    else:
+        name += f'_n{options["length"]}'
+    return name
+
+
+def point_file(directory, name, mode, k, lam):
+    '''
+    Returns the file where a sweep point is saved (lam written with repr,
+    so that every distinct lambda gets its own file)
+    '''
+    return os.path.join(directory, f'{_slug(name)}_{mode}_k{k}_lam{float(lam)!r}.npz')
+
+
+def _save_point(path, **arrays):
+    # written to a temporary file first, so that a crash never leaves a partial point
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def run_sweep(spec, directory, log=print):
+    '''
+    Computes the missing points of a sweep in directory and returns the
+    list of point files (computed now or in a previous run)
+
+    :param spec: a sweep spec (see the module docstring)
+    :param directory: output directory
+    :param log: a callable receiving progress messages
+    '''
+    os.makedirs(directory, exist_ok=True)
+    lams = [float(lam) for lam in spec.get('lambdas', [1])]
+    modes = spec.get('modes', ['non_aligned'])
+    files = []
+    seen = set()
+    for kind, base, options in expand_sequences(spec):
+        a_sequence = None
+        name = point_name(kind, base, options)
+        for mode in modes:
+            count_function, max_k_function = MODES[mode]
+            for k in _ks(spec, kind, base, options, lams, max_k_function):
+                missing = []
+                for lam in lams:
+                    path = point_file(directory, name, mode, k, lam)
+                    if path in seen:
+                        continue
+                    seen.add(path)
+                    files.append(path)
+                    if not os.path.exists(path):
+                        missing.append(lam)
+                if not missing:
+                    continue
+                if a_sequence is None:
+                    a_sequence = build_sequence(kind, base, options)
+                log(f'{a_sequence.name} {mode} k={k} lambdas={missing}')
+                for lam, (cnt_j, mx) in zip(missing, count_grid(a_sequence, [k], missing, count_function,
+                                                                histogram=True)[0]):
+                    freq = histogram_frequencies(cnt_j, base, k)
+                    _save_point(point_file(directory, name, mode, k, lam),
+                                sequence=a_sequence.name, length=a_sequence.length, base=base, mode=mode, k=k, lam=lam,
+                                cnt_j=cnt_j, frequencies=np.asarray(freq),
+                                total_variation=total_variation(freq, lam), max_j=mx)
+    return files
+
+
+def _ks(spec, kind, base, options, lams, max_k_function):
+    if 'ks' in spec:
+        first, last = spec['ks']
+        return range(first, last + 1)
+    if kind == 'file':
+        length = Sequence(base, '', file=options['path']).length
+    else:
+        length = options['length']
+    # the max k functions only look at the base and the length
+    sized = SimpleNamespace(base=base, length=length)
+    return range(1, min(max_k_function(sized, lam) for lam in lams) + 1)
+
+
+def load_points(files):
+    '''
+    Gathers point files in columns: sequence, length, base, mode, k, lam,
+    total_variation, max_j and frequencies (a 2-D array padded with zeros).
+    The length is -1 for points saved without it.
+    '''
+    points = []
+    for path in files:
+        with np.load(path) as point:
+            points.append({name: point[name] for name in point.files})
+            points[-1].setdefault('length', np.array(-1))
+    size = max((len(point['frequencies']) for point in points), default=0)
+    frequencies = np.zeros((len(points), size))
+    for row, point in enumerate(points):
+        frequencies[row, :len(point['frequencies'])] = point['frequencies']
+    columns = {name: np.array([point[name][()] for point in points])
+               for name in ('sequence', 'length', 'base', 'mode', 'k', 'lam', 'total_variation', 'max_j')}
+    columns['frequencies'] = frequencies
+    return columns
+
+
+def save_summary(columns, path):
+    '''
+    Saves the gathered columns as .npz, or as Parquet if path ends in .parquet
+    '''
+    if path.endswith('.parquet'):
+        import pandas as pd
+        df = pd.DataFrame({name: values for name, values in columns.items() if name != 'frequencies'})
+        df['frequencies'] = list(columns['frequencies'])
+        df.to_parquet(path)
+    else:
+        np.savez(path, **columns)
+
+
+def _parse_ks(value):
+    first, _, last = value.partition(':')
+    return [int(first), int(last or first)]
+
+
+def _parse_sequence(value):
+    kind, _, argument = value.partition(':')
+    if kind == 'file':
+        path, _, base = argument.rpartition(':')
+        return {'type': kind, 'path': path, 'base': int(base)}
+    return {'type': kind, 'length': int(float(argument))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('spec', nargs='?', help='JSON sweep spec (options below override it)')
+    parser.add_argument('--sequence', action='append',
+                        help='TYPE:LENGTH (thue_morse, rudin, fibonacci, random) or file:PATH:BASE, can be repeated')
+    parser.add_argument('--bases', help='comma separated bases, for sequences without one')
+    parser.add_argument('--ks', type=_parse_ks, help='k range as FIRST:LAST (inclusive)')
+    parser.add_argument('--lambdas', help='comma separated lambda values')
+    parser.add_argument('--modes', help='comma separated modes: non_aligned, aligned')
+    parser.add_argument('--output', required=True, help='output directory (existing points are kept)')
+    parser.add_argument('--summary', help='summary file (default: OUTPUT/summary.npz, .parquet also supported)')
+    args = parser.parse_args(argv)
+
+    spec = {}
+    if args.spec:
+        with open(args.spec) as afile:
+            spec = json.load(afile)
+    if args.sequence:
+        spec['sequences'] = [_parse_sequence(value) for value in args.sequence]
+    if args.bases:
+        spec['bases'] = [int(base) for base in args.bases.split(',')]
+    if args.ks:
+        spec['ks'] = args.ks
+    if args.lambdas:
+        spec['lambdas'] = [float(lam) for lam in args.lambdas.split(',')]
+    if args.modes:
+        spec['modes'] = args.modes.split(',')
+    if not spec.get('sequences'):
+        parser.error('no sequences given')
+    unknown = set(spec.get('modes', [])) - set(MODES)
+    if unknown:
+        parser.error(f'unknown modes: {", ".join(sorted(unknown))}')
+
+    files = run_sweep(spec, args.output, log=lambda message: print(message, flush=True))
+    summary = args.summary or os.path.join(args.output, 'summary.npz')
+    save_summary(load_points(files), summary)
+    print(f'{len(files)} points, summary saved to {summary}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
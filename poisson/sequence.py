@@ -4,96 +4,536 @@ Created on Nov 15, 2021
 
 @author: placiana
 '''
+import os
+
 import numpy as np
-import random
+
+from poisson.instrument import instrumented, stage
+
+
+# digit value -> character, and character -> digit value (255 if not a digit)
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+_DIGIT_TO_ASCII = np.frombuffer(ALPHABET.encode('ascii'), dtype=np.uint8)
+_ASCII_TO_DIGIT = np.full(256, 255, dtype=np.uint8)
+_ASCII_TO_DIGIT[_DIGIT_TO_ASCII] = np.arange(len(ALPHABET), dtype=np.uint8)
+_ASCII_TO_DIGIT[np.frombuffer(ALPHABET.lower().encode('ascii'), dtype=np.uint8)] = np.arange(len(ALPHABET), dtype=np.uint8)
+
+
+def digits_from_string(x):
+    '''
+    Returns the uint8 digit array of a sequence given as string
+    '''
+    return _ASCII_TO_DIGIT[np.frombuffer(x.encode('ascii'), dtype=np.uint8)]
+
+
+def check_digits(digits, base, source='sequence', start=0, text=None):
+    '''
+    Raises ValueError when digits hold a value that is not a base digit
+    (characters that are not digits are read as 255), so that they never
+    reach the counting tables
+
+    :param digits: a uint8 digit array
+    :param base: the sequence base
+    :param source: what the digits were read from, for the message
+    :param start: position of digits in source
+    :param text: the characters digits were converted from, if any
+    '''
+    if len(digits) == 0 or int(digits.max()) < base:
+        return
+    position = int(np.argmax(digits >= base))
+    value = int(digits[position])
+    if value < len(ALPHABET):
+        raise ValueError(f'{source}: {ALPHABET[value]!r} at position {start + position} is not a base {base} digit')
+    character = repr(chr(text[position])) if text is not None else 'a character'
+    raise ValueError(f'{source}: {character} at position {start + position} is not a digit '
+                     f'(digit files must only hold digits, without a "3." prefix or line breaks)')
+
+
+def digits_to_string(digits):
+    '''
+    Returns a uint8 digit array as string
+    '''
+    return _DIGIT_TO_ASCII[digits].tobytes().decode('ascii')
+
+
+def pack_digits(digits):
+    '''
+    Returns base 2 digits packed 8 per byte, the first digit in the
+    most significant bit (np.packbits order)
+    '''
+    return np.packbits(np.asarray(digits, dtype=np.uint8))
+
+
+def pack_blocks(blocks, length):
+    '''
+    Returns pack_digits of the concatenation of blocks of base 2 digits
+    (length digits in total, all blocks but the last one a multiple of 8 long)
+    without holding the unpacked digits
+    '''
+    bits = np.empty((length + 7) // 8, dtype=np.uint8)
+    position = 0
+    for block in blocks:
+        if position % 8:
+            raise ValueError('only the last block can have a length that is not a multiple of 8')
+        packed = np.packbits(block)
+        bits[position // 8:position // 8 + len(packed)] = packed
+        position += len(block)
+    return bits
 
 
 class Sequence(object):
     '''
-    A sequence (string) wrapper with additional info (base and name).
-    
+    A sequence wrapper with additional info (base and name).
+
+    Digits are held in a uint8 buffer (`digits`). File backed sequences are
+    memory mapped, so opening them is free; `get_digits` converts only the
+    requested slice. The `sequence` string is built lazily on first access.
+    Base 2 sequences can be packed 8 digits per byte (see pack).
     '''
-    def __init__(self, base, name, file=None, sequence=''):
+    def __init__(self, base, name, file=None, sequence='', packed=False):
         '''
         
         :param base: the sequence base
         :param name: the sequence name
         :param file: if sequence param not defined it will be read from this file
-        :param sequence: a sequence as string
+            (a text file of digits, or a .npy array of digit values)
+        :param sequence: a sequence as string or as an array of digits
+        :param packed: keep the digits packed (base 2 only, see pack)
         '''
         self.file = file
-        self.sequence = sequence
         self.base = base
         self.name = name
-        if not sequence:
+        if len(sequence) > 0:
+            self.sequence = sequence
+        else:
             if not file:
                 raise AttributeError('Should pass a file or an explicit sequence in constructor')
-            self.sequence = self.generate_sequence()
+            self.map_file()
+        if packed:
+            self.pack()
+
+    def map_file(self):
+        '''
+        Maps self.file. Text files are kept as characters and converted
+        on access, .npy files are expected to hold digit values.
+        '''
+        if str(self.file).endswith('.npy'):
+            self.digits = np.load(self.file, mmap_mode='r')
+            return
+        if os.path.getsize(self.file) == 0:
+            self.digits = np.empty(0, dtype=np.uint8)
+            return
+        text = np.memmap(self.file, dtype=np.uint8, mode='r')
+        length = len(text)
+        # ignore trailing line breaks and spaces
+        while length > 0 and int(text[length - 1]) in b' \r\n\t':
+            length -= 1
+        self._text = text[:length]
+        self._digits = None
+        self._bits = None
+        self._sequence = None
+        self._content_hashes = None
+        self.length = length
 
-        self.length = len(self.sequence)
+    @property
+    def digits(self):
+        '''
+        The sequence as a uint8 array of digit values
+        '''
+        if self._digits is None:
+            return self.get_digits()
+        return self._digits
 
-    def generate_sequence(self):
-        with open(self.file) as of:
-            return of.read()
+    @digits.setter
+    def digits(self, digits):
+        self._digits = np.asanyarray(digits, dtype=np.uint8)
+        if not isinstance(self._digits, np.memmap):
+            # mapped files are checked by slice in get_digits
+            check_digits(self._digits, self.base)
+        self._text = None
+        self._bits = None
+        self._sequence = None
+        self._content_hashes = None
+        self.length = len(self._digits)
+
+    @property
+    def packed(self):
+        '''
+        True when the digits are held packed, 8 per byte
+        '''
+        return getattr(self, '_bits', None) is not None
+
+    def pack(self):
+        '''
+        Packs the digits of a base 2 sequence 8 per byte (an 8x memory cut).
+        Digits are still available through get_digits (unpacking the
+        requested slice), and the counting functions read the bits directly.
+        Returns the sequence.
+        '''
+        self._check_packable()
+        if not self.packed:
+            content_hashes = getattr(self, '_content_hashes', None)
+            self.set_bits(pack_digits(self.get_digits()), self.length)
+            self._content_hashes = content_hashes
+        return self
 
-    def to_file(self, filename):
-        with open(filename, 'w+') as afile:
-                afile.write(self.sequence)
+    def _check_packable(self):
+        # packbits turns every nonzero digit into a 1
+        if self.base != 2:
+            raise ValueError(f'only base 2 sequences can be packed (base {self.base})')
+
+    def set_bits(self, bits, length):
+        '''
+        Sets the sequence from packed base 2 digits (see pack_digits)
+
+        :param bits: a uint8 array holding 8 digits per byte
+        :param length: number of digits
+        '''
+        self._check_packable()
+        self._bits = np.asarray(bits, dtype=np.uint8)
+        self._digits = None
+        self._text = None
+        self._sequence = None
+        self._content_hashes = None
+        self.length = length
+
+    def get_bits(self):
+        '''
+        Returns the digits packed 8 per byte (see pack_digits)
+        '''
+        if self.packed:
+            return self._bits
+        return pack_digits(self.get_digits())
+
+    @property
+    def file_backed(self):
+        '''
+        True when the digits are mapped from self.file
+        '''
+        return self._text is not None or isinstance(self._digits, np.memmap)
+
+    @property
+    def sequence(self):
+        '''
+        The sequence as string (built on first access)
+        '''
+        if self._sequence is None:
+            self._sequence = digits_to_string(self.get_digits())
+        return self._sequence
+
+    @sequence.setter
+    def sequence(self, sequence):
+        if isinstance(sequence, str):
+            self.digits = digits_from_string(sequence)
+            self._sequence = sequence
+        else:
+            self.digits = sequence
+
+    def get_digits(self, start=0, stop=None):
+        '''
+        Returns the digits in [start, stop) as a uint8 array. Only that
+        slice is read (and converted) for file backed sequences.
+        '''
+        if self._digits is not None:
+            digits = self._digits[start:stop]
+            if isinstance(self._digits, np.memmap):
+                check_digits(digits, self.base, self.file, slice(start, stop).indices(self.length)[0])
+            return digits
+        if self._bits is not None:
+            start, stop, _ = slice(start, stop).indices(self.length)
+            stop = max(start, stop)
+            with stage('unpack digits', nbytes=stop - start):
+                digits = np.unpackbits(self._bits[start // 8:(stop + 7) // 8])
+            return digits[start % 8:start % 8 + stop - start]
+        text = self._text[start:stop]
+        with stage('read digits', nbytes=len(text)):
+            digits = _ASCII_TO_DIGIT[text]
+            check_digits(digits, self.base, self.file, slice(start, stop).indices(self.length)[0], text)
+            return digits
+
+    def extend(self, digits):
+        '''
+        Appends digits (a string or a digit array) to the sequence
+        '''
+        if isinstance(digits, str):
+            digits = digits_from_string(digits)
+        self.digits = np.concatenate((self.get_digits(), np.asarray(digits, dtype=np.uint8)))
+
+    def iter_blocks(self, block_size=2 ** 24, overlap=0, start=0, stop=None):
+        '''
+        Yields (position, digits) for consecutive blocks of block_size digits
+        in [start, stop), each one extended with the next `overlap` digits
+        (when available). For file backed sequences only one block is read
+        at a time.
+        '''
+        stop = self.length if stop is None else min(stop, self.length)
+        for position in range(start, stop, block_size):
+            yield position, self.get_digits(position, min(position + block_size + overlap, stop))
+
+    def to_file(self, filename, block_size=2 ** 24):
+        with open(filename, 'wb') as afile:
+            for start, block in self.iter_blocks(block_size):
+                afile.write(_DIGIT_TO_ASCII[block].tobytes())
 
 
 class ThueMorseSequence(Sequence):
-    def __init__(self, length):
+    def __init__(self, length, packed=False):
         self.base = 2
         self.name = 'Thue-Morse'
         self.length = length
-        self.sequence = self.generate_sequence()
+        if packed:
+            self.set_bits(pack_blocks(_square_bits_blocks(thue_morse_digits, length), length), length)
+        else:
+            self.sequence = self.generate_sequence()
 
     def generate_sequence(self):
-        return ''.join([log_morse(i**2) for i in range(self.length)])
+        return thue_morse_digits(self.length)
 
 
 class RudinSequence(Sequence):
-    def __init__(self, length):
+    def __init__(self, length, packed=False):
         self.base = 2
         self.name = 'Rudin'
         self.length = length
-        self.sequence = self.generate_sequence()
+        if packed:
+            self.set_bits(pack_blocks(_square_bits_blocks(rudin_digits, length), length), length)
+        else:
+            self.sequence = self.generate_sequence()
 
     def generate_sequence(self):
-        return ''.join([log_rudin(i**2) for i in range(self.length)])
+        return rudin_digits(self.length)
 
 class FibonacciSequence(Sequence):
-    def __init__(self, base, length):
+    def __init__(self, base, length, file=None, packed=False):
+        '''
+
+        :param base: the sequence base
+        :param length: number of digits
+        :param file: if defined, digits are streamed to this file and mapped from it
+        :param packed: generate the digits packed 8 per byte (base 2 only)
+        '''
         self.base = base
         self.name = f'Fibonacci b{base}'
         self.length = length
-        self.sequence = self.generate_sequence()
+        self.file = file
+        if file:
+            write_fibonacci_digits(file, length, base)
+            self.map_file()
+        elif packed:
+            self._check_packable()
+            self.set_bits(pack_blocks(iter_fibonacci_digits(length, base), length), length)
+        else:
+            self.sequence = self.generate_sequence()
 
     def generate_sequence(self):
-        return fibonacci_sequence(self.length, self.base)
+        return fibonacci_digits(self.length, self.base)
 
 class RandomSequence(Sequence):
-    def __init__(self, base, length):
+    def __init__(self, base, length, seed=None, file=None, name=None, packed=False):
+        '''
+
+        :param base: the sequence base
+        :param length: number of digits
+        :param seed: an int or a numpy SeedSequence (a fresh one by default,
+            kept in self.seed so that the sequence can be drawn again)
+        :param file: if defined, digits are streamed to this file and mapped from it
+        :param name: the sequence name (Random b<base> by default)
+        :param packed: generate the digits packed 8 per byte (base 2 only)
+        '''
         self.base = base
-        self.name = f'Random b{base}'
+        self.name = name or f'Random b{base}'
         self.length = length
-        self.sequence = self.generate_sequence()
+        self.seed = seed_sequence(seed)
+        self.file = file
+        if file:
+            write_random_digits(file, length, base, self.seed)
+            self.map_file()
+        elif packed:
+            self._check_packable()
+            self.set_bits(pack_blocks(iter_random_digits(length, base, self.seed), length), length)
+        else:
+            self.sequence = self.generate_sequence()
 
+    @instrumented
     def generate_sequence(self):
-        return random.choices(range(self.base), k=self.length)
+        return random_digits(self.length, self.base, self.seed)
+
+
+def random_sequences(base, length, count, seed=None):
+    '''
+    Returns count RandomSequence objects drawn from independent streams
+    (spawned from seed), e.g. baselines for total variation comparisons
+    '''
+    return [RandomSequence(base, length, seed=child, name=f'Random b{base} #{index}')
+            for index, child in enumerate(seed_sequence(seed).spawn(count))]
+
+
+# Uniform random digits with numpy Generator streams
+
+# digits drawn per Generator call: a seed gives the same digits whether they
+# are generated at once, by blocks or to a file
+RANDOM_BLOCK_SIZE = 2 ** 20
+
+
+def seed_sequence(seed=None):
+    '''
+    Returns seed as a numpy SeedSequence (seed can be an int, a SeedSequence or None)
+    '''
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def iter_random_digits(length, base=10, seed=None):
+    '''
+    Yields length uniform random digits as uint8 arrays of RANDOM_BLOCK_SIZE
+    digits (the last one may be shorter)
+    '''
+    rng = np.random.Generator(np.random.PCG64(seed_sequence(seed)))
+    for start in range(0, length, RANDOM_BLOCK_SIZE):
+        yield rng.integers(0, base, min(RANDOM_BLOCK_SIZE, length - start), dtype=np.uint8)
+
+
+@instrumented
+def random_digits(length, base=10, seed=None):
+    '''
+    Returns length uniform random digits as a uint8 array
+    '''
+    digits = np.empty(length, dtype=np.uint8)
+    with stage('generate digits', nbytes=length):
+        for start, block in zip(range(0, length, RANDOM_BLOCK_SIZE), iter_random_digits(length, base, seed)):
+            digits[start:start + len(block)] = block
+    return digits
+
+
+@instrumented
+def random_digits_batch(count, length, base=10, seed=None):
+    '''
+    Returns a (count, length) uint8 array whose rows are the digits of
+    random_sequences(base, length, count, seed)
+    '''
+    digits = np.empty((count, length), dtype=np.uint8)
+    with stage('generate digits', nbytes=count * length):
+        for row, child in enumerate(seed_sequence(seed).spawn(count)):
+            for start, block in zip(range(0, length, RANDOM_BLOCK_SIZE), iter_random_digits(length, base, child)):
+                digits[row, start:start + len(block)] = block
+    return digits
+
+
+@instrumented
+def write_random_digits(filename, length, base=10, seed=None):
+    '''
+    Writes random_digits(length, base, seed) to filename, one block at a time
+    '''
+    with open(filename, 'wb') as afile, stage('generate digits', nbytes=length):
+        for block in iter_random_digits(length, base, seed):
+            afile.write(_DIGIT_TO_ASCII[block].tobytes())
 
 
 # Efficient fibonacci seq in  any base
 def fibonacci_sequence(length, base=10):
+    return digits_to_string(fibonacci_digits(length, base))
+
+
+@instrumented
+def fibonacci_digits(length, base=10):
+    '''
+    Returns fibonacci_sequence(length, base) as a uint8 digit array
+    '''
+    digits = np.empty(length, dtype=np.uint8)
+    start = 0
+    with stage('generate digits', nbytes=length):
+        for block in iter_fibonacci_digits(length, base):
+            digits[start:start + len(block)] = block
+            start += len(block)
+    return digits
+
+
+@instrumented
+def write_fibonacci_digits(filename, length, base=10, block_size=2 ** 20):
+    '''
+    Writes fibonacci_sequence(length, base) to filename, one block at a time
+    '''
+    with open(filename, 'wb') as afile, stage('generate digits', nbytes=length):
+        for block in iter_fibonacci_digits(length, base, block_size):
+            afile.write(_DIGIT_TO_ASCII[block].tobytes())
+
+
+def iter_fibonacci_digits(length, base=10, block_size=2 ** 20):
+    '''
+    Yields the digits of fibonacci_sequence(length, base) as uint8 arrays
+    of block_size digits (the last one may be shorter).
+    '''
+    block = np.empty(block_size, dtype=np.uint8)
+    fill = 0
     have = 0
-    chunks = []
     a, b = 0, 1
     while have < length:
-        add = np.base_repr(a, base)
-        chunks.append(add)
+        add = int_digits(a, base)[:length - have]
         have += len(add)
+        pos = 0
+        while pos < len(add):
+            take = min(block_size - fill, len(add) - pos)
+            block[fill:fill + take] = add[pos:pos + take]
+            fill += take
+            pos += take
+            if fill == block_size:
+                yield block.copy()
+                fill = 0
         a, b = b, a+b
-    return ''.join(chunks)[:length]
+    if fill:
+        yield block[:fill].copy()
+
+
+# powers base ** (leaf_width * 2 ** i) by base, shared by int_digits calls
+_RADIX_POWERS = {}
+
+
+def _leaf_width(base):
+    '''
+    Largest width w such that base ** w fits in an int64
+    '''
+    width = 1
+    while base ** (width + 1) < 2 ** 63:
+        width += 1
+    return width
+
+
+def _split_leaves(n, powers, level, leaves):
+    if level < 0:
+        leaves.append(n)
+        return
+    high, low = divmod(n, powers[level])
+    _split_leaves(high, powers, level - 1, leaves)
+    _split_leaves(low, powers, level - 1, leaves)
+
+
+def int_digits(n, base=10):
+    '''
+    Returns the digits of n >= 0 in base (as np.base_repr, most significant
+    first) as a uint8 array. Big numbers are split by divide and conquer
+    over base ** (width * 2 ** i) into int64 leaves expanded with NumPy.
+    '''
+    if n == 0:
+        return np.zeros(1, dtype=np.uint8)
+    if base == 2:
+        bits = np.unpackbits(np.frombuffer(n.to_bytes((n.bit_length() + 7) // 8, 'big'), dtype=np.uint8))
+        return bits[len(bits) - n.bit_length():]
+
+    width = _leaf_width(base)
+    powers = _RADIX_POWERS.setdefault(base, [base ** width])
+    levels = 0
+    while powers[levels] <= n:
+        levels += 1
+        if levels == len(powers):
+            powers.append(powers[-1] ** 2)
+    leaves = []
+    _split_leaves(n, powers, levels - 1, leaves)
+
+    place_values = np.array([base ** i for i in range(width - 1, -1, -1)], dtype=np.int64)
+    digits = (np.array(leaves, dtype=np.int64)[:, None] // place_values % base).astype(np.uint8).ravel()
+    return digits[np.argmax(digits != 0):]
+
 
 def log_morse(pos):
     power = 1
@@ -113,3 +553,84 @@ def log_rudin(pos):
         power *= 2
     return '0' if ans else '1'
 
+
+
+# Vectorized log_morse / log_rudin over the squares i**2, i in [start, start + length)
+
+_U1 = np.uint64(1)
+_U32 = np.uint64(32)
+_U33 = np.uint64(33)
+_U31 = np.uint64(31)
+_U63 = np.uint64(63)
+_LOW32 = np.uint64(0xFFFFFFFF)
+
+
+def _parity(x):
+    '''
+    Parity of the number of set bits of each uint64 in x (may modify x)
+    '''
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(x) & np.uint8(1)
+    for shift in (32, 16, 8, 4, 2, 1):
+        x ^= x >> np.uint64(shift)
+    return (x & _U1).astype(np.uint8)
+
+
+def _squares(n):
+    '''
+    Returns (high, low) uint64 words of n**2 for a uint64 array n
+    '''
+    hi = n >> _U32
+    lo = n & _LOW32
+    lo_sq = lo * lo
+    mid = hi * lo
+    low = lo_sq + (mid << _U33)
+    carry = (low < lo_sq).astype(np.uint64)
+    high = hi * hi + (mid >> _U31) + carry
+    return high, low
+
+
+def _square_bits_digits(length, start, chunk_size, digit_function):
+    digits = np.empty(length, dtype=np.uint8)
+    for chunk_start in range(start, start + length, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, start + length)
+        with stage('generate digits', nbytes=chunk_stop - chunk_start):
+            n = np.arange(chunk_start, chunk_stop, dtype=np.uint64)
+            if chunk_stop - 1 < 2 ** 32:
+                high, low = np.zeros_like(n), n * n
+            else:
+                high, low = _squares(n)
+            digits[chunk_start - start:chunk_stop - start] = digit_function(high, low)
+    return digits
+
+
+def _square_bits_blocks(digits_function, length, block_size=2 ** 22):
+    # thue_morse_digits or rudin_digits, block_size digits at a time
+    for start in range(0, length, block_size):
+        yield digits_function(min(block_size, length - start), start)
+
+
+def _morse_digit(high, low):
+    return _parity(high) ^ _parity(low)
+
+
+def _rudin_digit(high, low):
+    pairs_low = low & ((low >> _U1) | (high << _U63))
+    pairs_high = high & (high >> _U1)
+    return 1 - (_parity(pairs_high) ^ _parity(pairs_low))
+
+
+@instrumented
+def thue_morse_digits(length, start=0, chunk_size=2 ** 22):
+    '''
+    Returns [log_morse(i**2) for i in range(start, start + length)] as a uint8 digit array
+    '''
+    return _square_bits_digits(length, start, chunk_size, _morse_digit)
+
+
+@instrumented
+def rudin_digits(length, start=0, chunk_size=2 ** 22):
+    '''
+    Returns [log_rudin(i**2) for i in range(start, start + length)] as a uint8 digit array
+    '''
+    return _square_bits_digits(length, start, chunk_size, _rudin_digit)